@@ -0,0 +1,76 @@
+"""
+Micro-benchmark for the encoding of channel names in the administrative
+client.
+
+This compares the encoding of channel names with the implementation that was
+used before this code path was optimized. Run it with
+``python benchmarks/bench_channel_name_encoding.py`` from the root of the
+repository.
+"""
+
+import os.path
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from cassandra_pv_archiver import admin_client  # noqa: E402
+
+
+def legacy_encode_uri_part_custom(uri_part):
+    """
+    Encode a URI part using the original byte-by-byte loop.
+    """
+    bin_data = uri_part.encode('utf_8')
+    encoded_bin_data = bytearray()
+    for b in bin_data:
+        if (b == 0x2d or b == 0x5f or (0x30 <= b <= 0x39)
+                or (0x41 <= b <= 0x5a) or (0x61 <= b <= 0x7a)):
+            encoded_bin_data.append(b)
+        else:
+            high = b // 16
+            low = b % 16
+            high_b = (0x30 + high) if high < 10 else (0x37 + high)
+            low_b = (0x30 + low) if low < 10 else (0x37 + low)
+            encoded_bin_data.append(0x7e)
+            encoded_bin_data.append(high_b)
+            encoded_bin_data.append(low_b)
+    return encoded_bin_data.decode('ascii')
+
+
+def bench(name, func, number, items_per_call=1):
+    """
+    Run a function repeatedly and return the best time per item.
+    """
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    best /= number * items_per_call
+    print('{0:<45} {1:10.3f} us/item'.format(name, best * 1e6))
+    return best
+
+
+def main():
+    names = ['SR{0:02d}:BPM{1:03d}:Position-X.VAL'.format(i % 40, i)
+             for i in range(50000)]
+    unicode_names = ['Strahlstrom:Ä{0}:µA'.format(i) for i in range(50000)]
+    for label, sample in (('ASCII', names), ('non-ASCII', unicode_names)):
+        assert (admin_client.encode_many(sample[:1000])
+                == [legacy_encode_uri_part_custom(n) for n in sample[:1000]])
+        legacy = bench(
+            'legacy encode, {0}'.format(label),
+            lambda: [legacy_encode_uri_part_custom(n) for n in sample], 1,
+            len(sample))
+        admin_client._encode_cache.clear()
+        cold = bench(
+            'encode_many, {0}, cold cache'.format(label),
+            lambda: (admin_client._encode_cache.clear(),
+                     admin_client.encode_many(sample)), 1, len(sample))
+        warm = bench(
+            'encode_many, {0}, warm cache'.format(label),
+            lambda: admin_client.encode_many(sample), 1, len(sample))
+        print('  speedup: {0:.1f}x (cold), {1:.1f}x (warm)'.format(
+            legacy / cold, legacy / warm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Deadlines for requests sent by the web-service clients.
+
+A deadline is an absolute point in time (as returned by ``time.monotonic``)
+by which a whole operation, including receiving and decoding the response,
+has to be finished. ``None`` is used for operations without a deadline.
+"""
+
+import http.client
+import io
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def from_timeout(timeout):
+    """
+    Convert a timeout (in seconds, relative to now) to a deadline.
+
+    :param timeout: timeout in seconds or ``None``.
+    :return: deadline or ``None`` if ``timeout`` is ``None``.
+    """
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def remaining(deadline):
+    """
+    Return the time that remains until a deadline.
+
+    Raises a ``TimeoutError`` if the deadline has passed.
+
+    :param deadline: deadline or ``None``.
+    :return: remaining time in seconds or ``None`` if ``deadline`` is
+        ``None``.
+    """
+    if deadline is None:
+        return None
+    time_left = deadline - time.monotonic()
+    if time_left <= 0.0:
+        raise TimeoutError('Deadline exceeded')
+    return time_left
+
+
+class Cancellation(object):
+    """
+    Handle for cancelling a request from another thread.
+
+    Requests that are sent with a cancellation register their sockets with
+    it. Cancelling shuts these sockets down, so that a thread that is blocked
+    while connecting or waiting for the response is woken up immediately.
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._sockets = []
+
+    def cancel(self):
+        """
+        Cancel the request.
+
+        Calling this method more than once has no additional effect.
+        """
+        with self._lock:
+            self._cancelled = True
+            sockets = self._sockets
+            self._sockets = []
+        for sock in sockets:
+            _shut_down(sock)
+
+    def is_cancelled(self):
+        """
+        Tell whether the request has been cancelled.
+
+        :return: ``True`` if ``cancel`` has been called, ``False`` otherwise.
+        """
+        return self._cancelled
+
+    def _register(self, sock):
+        """
+        Register a socket that is shut down when the request is cancelled.
+
+        Raises an exception if the request has already been cancelled.
+        """
+        with self._lock:
+            if not self._cancelled:
+                self._sockets.append(sock)
+                return
+        raise Exception('Request cancelled')
+
+
+def urlopen(req, deadline=None, cancellation=None):
+    """
+    Send a request object and return the response.
+
+    If an ``HTTPError`` is raised, it is caught and returned instead of the
+    response object. If a deadline or a cancellation is specified, the response
+    is wrapped, so that reading from it fails once the deadline has passed or
+    the request has been cancelled.
+
+    :param req: request object.
+    :param deadline: deadline for the whole request or ``None``.
+    :param cancellation: ``Cancellation`` for cancelling the request or
+        ``None``.
+    :return: response object.
+    """
+    timeout = remaining(deadline)
+    if cancellation is None:
+        opener_open = urllib.request.urlopen
+    else:
+        # Only the connections created by this handler register their sockets
+        # with the cancellation, so we need a separate opener.
+        opener_open = urllib.request.build_opener(
+            _CancellableHTTPHandler(cancellation)).open
+    try:
+        if timeout is None:
+            resp = opener_open(req)
+        else:
+            resp = opener_open(req, timeout=timeout)
+    except urllib.error.HTTPError as err:
+        resp = err
+    except urllib.error.URLError as err:
+        # A timeout while connecting is wrapped in a URLError, but it should be
+        # reported like a timeout that happens later.
+        if isinstance(err.reason, TimeoutError):
+            raise TimeoutError('Deadline exceeded') from err
+        if cancellation is not None and cancellation.is_cancelled():
+            raise Exception('Request cancelled') from err
+        raise
+    except OSError:
+        if cancellation is not None and cancellation.is_cancelled():
+            raise Exception('Request cancelled')
+        raise
+    if deadline is None and cancellation is None:
+        return resp
+    return DeadlineResponse(resp, deadline, cancellation)
+
+
+class DeadlineResponse(io.BufferedIOBase):
+    """
+    Wrapper around a response that enforces a deadline while reading.
+
+    Before each read, the timeout of the underlying socket is reduced to the
+    time that remains until the deadline, so that a single slow read cannot
+    extend the operation beyond the deadline.
+    """
+
+    def __init__(self, resp, deadline, cancellation):
+        super(DeadlineResponse, self).__init__()
+        self.code = resp.code
+        self.headers = resp.headers
+        self._cancellation = cancellation
+        self._deadline = deadline
+        self._resp = resp
+        self._sock = _find_socket(resp)
+
+    def close(self):
+        if not self.closed:
+            self._resp.close()
+        super(DeadlineResponse, self).close()
+
+    def read(self, size=-1):
+        self._check()
+        if size is None or size < 0:
+            return self._resp.read()
+        return self._resp.read(size)
+
+    def read1(self, size=-1):
+        if size is None or size < 0 or not hasattr(self._resp, 'read1'):
+            return self.read(size)
+        self._check()
+        return self._resp.read1(size)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        self._check()
+        return self._resp.readinto(buffer)
+
+    def _check(self):
+        """
+        Raise an exception if the request has been cancelled or the deadline
+        has passed, and adjust the socket timeout otherwise.
+        """
+        if (self._cancellation is not None
+                and self._cancellation.is_cancelled()):
+            raise Exception('Request cancelled')
+        time_left = remaining(self._deadline)
+        if time_left is not None and self._sock is not None:
+            # noinspection PyBroadException
+            try:
+                self._sock.settimeout(time_left)
+            except Exception:
+                # The socket might already have been closed after reading the
+                # whole response, and then there is nothing left to limit.
+                self._sock = None
+
+
+def _find_socket(resp):
+    """
+    Return the socket from which a response is read or ``None`` if it cannot
+    be determined.
+    """
+    # This depends on implementation details of http.client, so we simply give
+    # up if the structure is not as expected. In that case, the deadline is
+    # still checked before each read.
+    raw = getattr(getattr(resp, 'fp', None), 'raw', None)
+    return getattr(raw, '_sock', None)
+
+
+class _CancellableHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection that registers its socket with a ``Cancellation``.
+    """
+
+    def __init__(self, *args, cancellation, **kwargs):
+        super(_CancellableHTTPConnection, self).__init__(*args, **kwargs)
+        self._cancellation = cancellation
+
+    def connect(self):
+        # socket.create_connection only returns the socket once it is
+        # connected, but we need to register it before, so that a connection
+        # attempt that hangs can be cancelled as well.
+        error = None
+        for family, sock_type, proto, _, address in socket.getaddrinfo(
+                self.host, self.port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(family, sock_type, proto)
+            try:
+                if isinstance(self.timeout, (int, float)):
+                    sock.settimeout(self.timeout)
+                if self.source_address:
+                    sock.bind(self.source_address)
+                self._cancellation._register(sock)
+                sock.connect(address)
+            except OSError as e:
+                sock.close()
+                error = e
+                continue
+            except BaseException:
+                sock.close()
+                raise
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock = sock
+            return
+        if error is None:
+            error = OSError('getaddrinfo returned an empty list')
+        raise error
+
+
+class _CancellableHTTPHandler(urllib.request.HTTPHandler):
+    """
+    Handler for HTTP requests that can be cancelled with a ``Cancellation``.
+    """
+
+    def __init__(self, cancellation):
+        super(_CancellableHTTPHandler, self).__init__()
+        self._cancellation = cancellation
+
+    def http_open(self, req):
+        def connection_factory(*args, **kwargs):
+            return _CancellableHTTPConnection(
+                *args, cancellation=self._cancellation, **kwargs)
+        return self.do_open(connection_factory, req)
+
+
+def _shut_down(sock):
+    """
+    Shut a socket down, waking up any thread that is blocked on it.
+
+    The socket is not closed, because its file descriptor might still be in use
+    by the thread that owns the connection, which closes it when it notices the
+    error.
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # The socket might not be connected yet or might already be closed.
+        pass
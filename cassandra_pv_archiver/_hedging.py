@@ -0,0 +1,244 @@
+"""
+Hedged requests for the archive client.
+
+A hedged request is first sent to the primary server. If it has not finished
+after a delay (by default the 95th percentile of the recently observed
+latencies), the same request is also sent to another server, and whichever
+attempt finishes first provides the result. The other attempt is cancelled.
+This cuts the tail latency caused by an occasional slow server at the cost of
+a few additional requests.
+"""
+
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+from cassandra_pv_archiver import _deadline
+
+# Delay (in seconds) that is used before enough latencies have been observed
+# for estimating the 95th percentile.
+_DEFAULT_HEDGE_DELAY = 1.0
+
+# Number of latencies that have to be observed before the 95th percentile is
+# used as the hedge delay.
+_MIN_LATENCY_SAMPLES = 20
+
+
+class Hedger(object):
+    """
+    Runner for hedged requests.
+
+    The primary attempt runs in the calling thread. A single scheduler thread
+    keeps track of the requests that are in progress and starts a hedge
+    attempt for each request that has not finished when its hedge delay has
+    passed. The hedge attempts run in a small pool of threads. When one of the
+    attempts succeeds, the other one is cancelled by shutting down its
+    connection, so it does not keep running in the background.
+    """
+
+    def __init__(self, server_count, hedge_delay=None, max_history=256,
+                 max_hedges=4):
+        """
+        Create a runner for hedged requests.
+
+        :param server_count:
+            total number of servers (including the primary server, which has
+            index zero).
+        :param hedge_delay:
+            delay (in seconds) after which the hedge request is sent. If
+            ``None``, the 95th percentile of the recently observed latencies
+            is used.
+        :param max_history:
+            number of recently observed latencies that are used for estimating
+            the 95th percentile.
+        :param max_hedges:
+            maximum number of hedge attempts that run at the same time. Hedge
+            attempts that exceed this number wait until one of the running
+            ones has finished.
+        """
+        self._condition = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_hedges, thread_name_prefix='HedgedRequest')
+        self._hedge_delay = hedge_delay
+        self._latencies = collections.deque(maxlen=max_history)
+        self._lock = threading.Lock()
+        self._next_hedge_server = 0
+        self._scheduled = []
+        self._scheduler_thread = None
+        self._sequence = itertools.count()
+        self._server_count = server_count
+
+    def run(self, attempt, deadline=None):
+        """
+        Run a hedged request.
+
+        :param attempt:
+            function that takes the index of a server and a
+            ``_deadline.Cancellation`` and sends the request to that server.
+            It must send the request with that cancellation, so that it stops
+            (by raising an exception) when the attempt is cancelled.
+        :param deadline:
+            deadline for the whole request or ``None``.
+        :return:
+            result of the attempt that finished successfully first. If the
+            primary attempt fails before a hedge attempt has succeeded, its
+            exception is raised and the hedge attempt is cancelled.
+        """
+        request = _HedgedRequest(attempt)
+        if self._server_count > 1:
+            self._schedule(
+                request, time.monotonic() + self._get_hedge_delay())
+        start_time = time.monotonic()
+        try:
+            result = attempt(0, request.primary_cancellation)
+        except BaseException as e:
+            hedge_future = request.finish_primary(False)
+            if hedge_future is None:
+                raise
+            if not request.primary_cancellation.is_cancelled():
+                # The primary attempt failed on its own, so we report its
+                # error like for a request that is not hedged. Waiting for
+                # the hedge attempt instead could block forever if there is
+                # no deadline.
+                request.hedge_cancellation.cancel()
+                hedge_future.cancel()
+                raise
+            primary_error = e
+        else:
+            self._record_latency(time.monotonic() - start_time)
+            request.finish_primary(True)
+            return result
+        # The primary attempt is only cancelled after the hedge attempt has
+        # succeeded, so the hedge attempt's result is about to be available.
+        try:
+            return hedge_future.result(_deadline.remaining(deadline))
+        except concurrent.futures.TimeoutError:
+            request.hedge_cancellation.cancel()
+            raise TimeoutError('Deadline exceeded') from primary_error
+        except Exception as e:
+            raise e from primary_error
+
+    def _get_hedge_delay(self):
+        """
+        Return the delay after which the hedge request is sent.
+        """
+        if self._hedge_delay is not None:
+            return self._hedge_delay
+        with self._lock:
+            if len(self._latencies) < _MIN_LATENCY_SAMPLES:
+                return _DEFAULT_HEDGE_DELAY
+            latencies = sorted(self._latencies)
+        return latencies[(len(latencies) * 95) // 100]
+
+    def _get_hedge_server(self):
+        """
+        Return the index of the server to which the next hedge request is sent.
+
+        The servers other than the primary one are used in turn.
+        """
+        with self._lock:
+            index = self._next_hedge_server
+            self._next_hedge_server = (index + 1) % (self._server_count - 1)
+        return index + 1
+
+    def _record_latency(self, latency):
+        """
+        Record the latency of a successful attempt.
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _run_hedge(self, request, server_index):
+        """
+        Run the hedge attempt for a request.
+
+        This method runs in one of the threads of the executor.
+        """
+        start_time = time.monotonic()
+        result = request.attempt(server_index, request.hedge_cancellation)
+        self._record_latency(time.monotonic() - start_time)
+        request.primary_cancellation.cancel()
+        return result
+
+    def _run_scheduler(self):
+        """
+        Start the hedge attempts when their delays have passed.
+
+        This method runs in the scheduler thread.
+        """
+        while True:
+            with self._condition:
+                while True:
+                    wait_time = None
+                    if self._scheduled:
+                        wait_time = self._scheduled[0][0] - time.monotonic()
+                        if wait_time <= 0.0:
+                            break
+                    self._condition.wait(wait_time)
+                _, _, request = heapq.heappop(self._scheduled)
+            request.start_hedge(
+                lambda: self._executor.submit(
+                    self._run_hedge, request, self._get_hedge_server()))
+
+    def _schedule(self, request, hedge_time):
+        """
+        Schedule the hedge attempt for a request.
+        """
+        with self._condition:
+            heapq.heappush(
+                self._scheduled, (hedge_time, next(self._sequence), request))
+            if self._scheduler_thread is None:
+                self._scheduler_thread = threading.Thread(
+                    target=self._run_scheduler,
+                    name='HedgeScheduler',
+                    daemon=True)
+                self._scheduler_thread.start()
+            self._condition.notify()
+
+
+class _HedgedRequest(object):
+    """
+    State of a hedged request that is in progress.
+    """
+
+    def __init__(self, attempt):
+        self.attempt = attempt
+        self.hedge_cancellation = _deadline.Cancellation()
+        self.primary_cancellation = _deadline.Cancellation()
+        self._hedge_future = None
+        self._lock = threading.Lock()
+        self._primary_finished = False
+
+    def finish_primary(self, success):
+        """
+        Record that the primary attempt has finished.
+
+        If the primary attempt was successful, the hedge attempt is cancelled
+        (or not started at all).
+
+        :param success: ``True`` if the primary attempt was successful.
+        :return: future of the hedge attempt or ``None`` if no hedge attempt
+            has been started.
+        """
+        with self._lock:
+            self._primary_finished = True
+            hedge_future = self._hedge_future
+        if success:
+            self.hedge_cancellation.cancel()
+            if hedge_future is not None:
+                hedge_future.cancel()
+        return hedge_future
+
+    def start_hedge(self, submit):
+        """
+        Start the hedge attempt unless the primary attempt has finished.
+
+        :param submit: function that starts the hedge attempt and returns its
+            future.
+        """
+        with self._lock:
+            if not self._primary_finished:
+                self._hedge_future = submit()
@@ -0,0 +1,252 @@
+"""
+Incremental parsing of JSON documents read from a stream.
+
+The web-service clients use the functions in this module for processing large
+responses without holding the whole response (or the whole decoded object
+tree) in memory. Only the parts of a document that are needed are decoded, and
+they are decoded piece by piece while the response is being read.
+"""
+
+import json
+import re
+
+_DEFAULT_CHUNK_SIZE = 65536
+
+_STRING_SPECIAL_CHARS_PATTERN = re.compile(r'["\\]')
+
+_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+
+
+class JsonStreamReader(object):
+    """
+    Reader that decodes a JSON document from a text stream incrementally.
+
+    The reader keeps a buffer with the part of the document that has been read
+    but not consumed yet. This buffer only grows beyond the chunk size when a
+    single value that is decoded as a whole is larger than the chunk size.
+    """
+
+    def __init__(self, text_stream, chunk_size=_DEFAULT_CHUNK_SIZE):
+        """
+        Create a reader for the specified stream.
+
+        :param text_stream:
+            file-like object providing the JSON document as text (``str``).
+        :param chunk_size:
+            number of characters that are read from the stream at once.
+        """
+        self._buffer = ''
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._eof = False
+        self._pos = 0
+        self._stream = text_stream
+
+    def expect(self, char):
+        """
+        Skip whitespace and consume the specified character.
+
+        Raises an exception if the next non-whitespace character is a different
+        one.
+        """
+        if self.peek() != char:
+            raise Exception(
+                'Malformed JSON document: expected "{0}", but found "{1}".'
+                .format(char, self.peek() or 'end of document'))
+        self._pos += 1
+
+    def find_key(self, key):
+        """
+        Find a key in the object that starts at the current position.
+
+        The opening brace of the object must not have been consumed yet. The
+        values of all keys that precede the requested key are decoded and
+        discarded. After this method returns ``True``, the reader is positioned
+        at the start of the value for the key.
+
+        :param key: key that shall be found.
+        :return: ``True`` if the key was found, ``False`` if the end of the
+            object was reached without finding the key.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return False
+        while True:
+            current_key = self.read_value()
+            self.expect(':')
+            if current_key == key:
+                return True
+            self.read_value()
+            if self.peek() == ',':
+                self._pos += 1
+            else:
+                self.expect('}')
+                return False
+
+    def iter_array_items(self):
+        """
+        Decode the array at the current position item by item.
+
+        The opening bracket of the array must not have been consumed yet. Each
+        item is decoded as a whole, but only one item is held in memory at a
+        time.
+
+        :return: iterator over the decoded items of the array.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.peek() == ',':
+                self._pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def iter_string_chunks(self):
+        """
+        Decode the string at the current position chunk by chunk.
+
+        The opening quotation mark of the string must not have been consumed
+        yet. The string is never held in memory completely. Instead, its
+        contents are returned as a sequence of (unescaped) chunks.
+
+        :return: iterator over the parts of the string.
+        """
+        self.expect('"')
+        while True:
+            match = _STRING_SPECIAL_CHARS_PATTERN.search(
+                self._buffer, self._pos)
+            if match is None:
+                if self._pos < len(self._buffer):
+                    yield self._buffer[self._pos:]
+                self._pos = len(self._buffer)
+                if not self._fill():
+                    raise Exception(
+                        'Malformed JSON document: unterminated string.')
+                continue
+            special_pos = match.start()
+            if special_pos > self._pos:
+                yield self._buffer[self._pos:special_pos]
+            self._pos = special_pos
+            if self._buffer[special_pos] == '"':
+                self._pos += 1
+                return
+            yield self._read_escape_sequence()
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        :return: next character or the empty string if the end of the document
+            has been reached.
+        """
+        while True:
+            self._pos = _WHITESPACE_PATTERN.match(
+                self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def read_value(self):
+        """
+        Decode and return the (complete) value at the current position.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer might continue in the next
+                # chunk, so we only accept a value ending at the end of the
+                # buffer when there is no more data.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _fill(self):
+        """
+        Read the next chunk from the stream and append it to the buffer.
+
+        :return: ``True`` if data was read, ``False`` if the end of the stream
+            has been reached.
+        """
+        if self._eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # We drop the already consumed part of the buffer so that the buffer
+        # does not grow with the size of the document.
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _read_escape_sequence(self):
+        """
+        Decode the escape sequence at the current position.
+        """
+        while len(self._buffer) - self._pos < 2:
+            if not self._fill():
+                raise Exception(
+                    'Malformed JSON document: unterminated string.')
+        length = 6 if self._buffer[self._pos + 1] == 'u' else 2
+        while len(self._buffer) - self._pos < length + 6:
+            if not self._fill():
+                break
+        if (length == 6
+                and 0xd800 <= int(self._buffer[self._pos + 2:self._pos + 6],
+                                  16) < 0xdc00
+                and self._buffer[self._pos + 6:self._pos + 8] == '\\u'):
+            # A high surrogate has to be decoded together with the following
+            # low surrogate.
+            length = 12
+        sequence = self._buffer[self._pos:self._pos + length]
+        self._pos += length
+        return json.loads('"' + sequence + '"')
+
+
+def iter_array(text_stream, key=None):
+    """
+    Iterate over the items of an array in a JSON document.
+
+    :param text_stream:
+        file-like object providing the JSON document as text.
+    :param key:
+        key of the array in the top-level object of the document. If ``None``
+        (the default), the top-level value of the document must be the array.
+    :return:
+        iterator over the decoded items of the array.
+    """
+    reader = JsonStreamReader(text_stream)
+    if key is not None and not reader.find_key(key):
+        raise Exception(
+            'Response does not contain the expected field "{0}".'.format(key))
+    return reader.iter_array_items()
+
+
+def iter_string(text_stream, key):
+    """
+    Iterate over the parts of a string in the top-level object of a JSON
+    document.
+
+    :param text_stream:
+        file-like object providing the JSON document as text.
+    :param key:
+        key of the string in the top-level object of the document.
+    :return:
+        iterator over the (unescaped) parts of the string.
+    """
+    reader = JsonStreamReader(text_stream)
+    if not reader.find_key(key):
+        raise Exception(
+            'Response does not contain the expected field "{0}".'.format(key))
+    return reader.iter_string_chunks()
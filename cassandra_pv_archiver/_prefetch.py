@@ -0,0 +1,233 @@
+"""
+Predictive prefetching of samples for the archive client.
+
+The prefetcher watches the sequence of sample queries for each channel,
+predicts the windows that are likely to be requested next (when the user pans
+or zooms step by step), and fetches them in the background while no requests
+made by the user are in progress.
+"""
+
+import collections
+import threading
+import time
+
+from cassandra_pv_archiver import _deadline
+
+# A window is considered to have the same width as the previous one if the
+# widths differ by less than this fraction.
+_SAME_WIDTH_TOLERANCE = 0.01
+
+
+class Prefetcher(object):
+    """
+    Prefetcher for sample queries.
+
+    The prefetcher keeps the results of prefetched queries in a bounded cache
+    (evicting the least recently used entry when it is full). Windows that
+    extend to the present or the future are never prefetched or cached,
+    because new samples might still be added to them. Prefetch
+    requests are only started when no requests made by the user are in
+    progress, so that they never compete with the user's requests.
+    """
+
+    def __init__(self, query, max_workers=2, cache_size=64,
+                 max_history=1024, timeout=None):
+        """
+        Create a prefetcher.
+
+        :param query:
+            function that takes a channel name, a start time, an end time, a
+            count, and a deadline and returns the samples for the respective
+            query.
+        :param max_workers:
+            number of background threads that run prefetch requests.
+        :param cache_size:
+            maximum number of prefetched results that are kept.
+        :param max_history:
+            maximum number of channels for which the last query is remembered.
+        :param timeout:
+            timeout (in seconds) for each prefetch request or ``None`` if
+            prefetch requests shall not time out.
+        """
+        self._active_user_requests = 0
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._condition = threading.Condition()
+        self._history = collections.OrderedDict()
+        self._in_progress = {}
+        self._max_history = max_history
+        self._query = query
+        self._queue = collections.deque(maxlen=4 * max_workers)
+        self._stopped = False
+        self._timeout = timeout
+        self._workers = [
+            threading.Thread(
+                target=self._run_worker, name='Prefetcher', daemon=True)
+            for _ in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def get(self, channel_name, start_time, end_time, count, deadline=None):
+        """
+        Return the samples for a query made by the user.
+
+        The result is taken from the cache if the query has been prefetched.
+        Otherwise, it is fetched immediately in the calling thread. In both
+        cases, the query is used for predicting the next queries.
+
+        If the deadline passes before the result is available, a
+        ``TimeoutError`` is raised.
+        """
+        key = (channel_name, start_time, end_time, count)
+        with self._condition:
+            self._active_user_requests += 1
+        try:
+            result = self._get_prefetched(key, deadline)
+            if result is None:
+                result = self._query(*key, deadline)
+        finally:
+            with self._condition:
+                self._active_user_requests -= 1
+                self._condition.notify_all()
+        self._predict(channel_name, start_time, end_time, count)
+        return result
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the background threads and discard all prefetched results.
+
+        Threads that are waiting for the response to a prefetch request only
+        stop when the request has finished. This method waits for them at most
+        ``timeout`` seconds. Threads that are still running after that
+        discard their result and stop in the background.
+
+        :param timeout: maximum time (in seconds) that is spent waiting for
+            the threads to stop.
+        """
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            self._cache.clear()
+            self._condition.notify_all()
+        end_time = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, end_time - time.monotonic()))
+
+    def _get_prefetched(self, key, deadline):
+        """
+        Return the prefetched result for a query or ``None`` if the query has
+        not been prefetched.
+
+        If a prefetch request for the query is in progress, this method waits
+        for it to finish instead of sending a second request.
+        """
+        with self._condition:
+            while key in self._in_progress:
+                self._condition.wait(_deadline.remaining(deadline))
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+            return result
+
+    def _predict(self, channel_name, start_time, end_time, count):
+        """
+        Remember a query and schedule prefetch requests for the queries that
+        are likely to follow.
+        """
+        width = end_time - start_time
+        with self._condition:
+            previous = self._history.pop(channel_name, None)
+            self._history[channel_name] = (start_time, end_time, count)
+            if len(self._history) > self._max_history:
+                self._history.popitem(last=False)
+        predictions = []
+        if previous is not None:
+            previous_start, previous_end, previous_count = previous
+            previous_width = previous_end - previous_start
+            if (previous_width > 0 and abs(width - previous_width)
+                    <= _SAME_WIDTH_TOLERANCE * previous_width):
+                step = start_time - previous_start
+                if step != 0:
+                    # The user is panning, so we expect the next window to be
+                    # shifted by the same amount.
+                    predictions.append(
+                        (start_time + step, end_time + step, count))
+                elif count > 0 and previous_count > 0 \
+                        and count != previous_count:
+                    # The user is changing the resolution, so we expect the
+                    # same window with the count changed by the same factor.
+                    predictions.append(
+                        (start_time,
+                         end_time,
+                         max(1, count * count // previous_count)))
+            elif previous_width > 0 and width > 0:
+                # The user is zooming, so we expect the next window to be
+                # scaled by the same factor (around the same center).
+                new_width = width * width // previous_width
+                center = start_time + width // 2
+                predictions.append(
+                    (center - new_width // 2,
+                     center - new_width // 2 + new_width,
+                     count))
+        if not predictions and width > 0:
+            # Without a recognizable pattern, the adjacent windows are the
+            # most likely next queries. Most users scroll forward, so the
+            # next window is prefetched before the previous one.
+            predictions.append((end_time, end_time + width, count))
+            predictions.append((start_time - width, start_time, count))
+            if count > 0:
+                # The user might also ask for more detail without changing the
+                # window. This is less likely, so it is prefetched last.
+                predictions.append((start_time, end_time, 2 * count))
+        now = time.time_ns()
+        predictions = [
+            prediction for prediction in predictions if prediction[1] < now]
+        with self._condition:
+            if self._stopped:
+                return
+            # The predictions are ordered from the most to the least likely
+            # one and are put in front of older predictions, which are less
+            # likely to be requested by now.
+            self._queue.extendleft(
+                (channel_name,) + prediction
+                for prediction in reversed(predictions))
+            self._condition.notify_all()
+
+    def _run_worker(self):
+        """
+        Run prefetch requests until the prefetcher is stopped.
+        """
+        while True:
+            with self._condition:
+                # We only start a prefetch request while the user is not
+                # waiting for a request, so that prefetching only uses
+                # capacity that would otherwise be idle.
+                while not self._stopped and (
+                        not self._queue or self._active_user_requests > 0):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                key = self._queue.popleft()
+                if key in self._cache or key in self._in_progress:
+                    continue
+                self._in_progress[key] = True
+            result = None
+            # noinspection PyBroadException
+            try:
+                result = self._query(
+                    *key, _deadline.from_timeout(self._timeout))
+            except Exception:
+                # A failed prefetch is not an error. If the user actually
+                # requests the data, the request is simply sent again.
+                pass
+            with self._condition:
+                del self._in_progress[key]
+                # A window that extends to the present might still receive new
+                # samples, so its result must not be served from the cache.
+                if result is not None and not self._stopped \
+                        and key[2] < time.time_ns():
+                    self._cache[key] = result
+                    while len(self._cache) > self._cache_size:
+                        self._cache.popitem(last=False)
+                self._condition.notify_all()
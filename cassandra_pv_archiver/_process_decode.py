@@ -0,0 +1,155 @@
+"""
+Decoding of sample responses in a pool of worker processes.
+
+Decompressing and decoding large JSON responses is CPU-bound and holds the
+global interpreter lock, so threads cannot do it in parallel. The
+``ProcessDecoder`` therefore sends the raw (still compressed) response bodies
+to worker processes. The workers convert the samples to arrays and pass them
+back through shared memory, so that the result does not have to be pickled.
+"""
+
+import array
+import concurrent.futures
+import gzip
+import json
+import multiprocessing
+from multiprocessing import shared_memory
+
+from cassandra_pv_archiver import _deadline
+from cassandra_pv_archiver import sample_arrays
+
+
+class ProcessDecoder(object):
+    """
+    Pool of worker processes that decode sample responses.
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Create a pool of worker processes.
+
+        :param max_workers:
+            number of worker processes. If ``None``, the number of CPUs is
+            used.
+        """
+        # The client uses threads, so we must not fork the worker processes.
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'))
+
+    def decode(self, body, content_encoding, charset, waveforms=False,
+               deadline=None):
+        """
+        Decode a response body with samples into arrays.
+
+        :param body: response body (as received from the server).
+        :param content_encoding: value of the ``Content-Encoding`` header or
+            ``None``.
+        :param charset: charset of the JSON document.
+        :param waveforms: decode the samples into ``WaveformArrays`` instead
+            of ``SampleArrays``?
+        :param deadline: deadline for the decoding or ``None``.
+        :return: ``SampleArrays`` or ``WaveformArrays`` with the samples.
+        """
+        future = self._executor.submit(
+            _decode_to_shared_memory,
+            body,
+            content_encoding,
+            charset,
+            waveforms)
+        try:
+            result = future.result(_deadline.remaining(deadline))
+        except TimeoutError:
+            # If the worker still finishes, it leaves the shared memory block
+            # behind, so we release it as soon as the result is available.
+            future.add_done_callback(_release_abandoned_result)
+            raise
+        return _read_from_shared_memory(*result)
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _decode_to_shared_memory(body, content_encoding, charset, waveforms):
+    """
+    Decode a response body and store the arrays in a new shared memory block.
+
+    This function runs in a worker process.
+
+    :return: tuple of the name of the shared memory block (``None`` if all
+        arrays are empty), the layout of the block, and the ``waveforms``
+        flag. The layout is a list with a tuple of the type code and the length
+        for each array (``None`` for arrays that are not present).
+    """
+    if content_encoding == 'gzip':
+        body = gzip.decompress(body)
+    samples = json.loads(body.decode(charset))
+    if waveforms:
+        arrays = sample_arrays.waveforms_from_samples(samples)
+    else:
+        arrays = sample_arrays.from_samples(samples)
+    columns = [getattr(arrays, name) for name in arrays._COLUMN_NAMES]
+    layout = [
+        None if column is None else (column.typecode, len(column))
+        for column in columns
+    ]
+    size = sum(
+        column.itemsize * len(column)
+        for column in columns if column is not None)
+    if size == 0:
+        return None, layout, waveforms
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        offset = 0
+        for column in columns:
+            if column is None:
+                continue
+            data = memoryview(column).cast('B')
+            shm.buf[offset:offset + len(data)] = data
+            offset += len(data)
+    finally:
+        shm.close()
+    return shm.name, layout, waveforms
+
+
+def _read_from_shared_memory(name, layout, waveforms):
+    """
+    Copy the arrays out of a shared memory block created by
+    ``_decode_to_shared_memory`` and release the block.
+    """
+    columns = [
+        None if column_layout is None else array.array(column_layout[0])
+        for column_layout in layout
+    ]
+    if name is not None:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            offset = 0
+            for column, column_layout in zip(columns, layout):
+                if column is None:
+                    continue
+                size = column.itemsize * column_layout[1]
+                column.frombytes(shm.buf[offset:offset + size])
+                offset += size
+        finally:
+            shm.close()
+            shm.unlink()
+    if waveforms:
+        return sample_arrays.WaveformArrays(*columns)
+    return sample_arrays.SampleArrays(*columns)
+
+
+def _release_abandoned_result(future):
+    """
+    Release the shared memory block of a result that nobody waits for anymore.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    name = future.result()[0]
+    if name is not None:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
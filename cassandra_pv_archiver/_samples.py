@@ -0,0 +1,22 @@
+"""
+Helpers for accessing the fields of samples (as returned by the server).
+"""
+
+
+def get_number(sample, key):
+    """
+    Return the single number stored under a key of a sample.
+
+    :param sample: sample (as returned by the server).
+    :param key: key of the field (e.g. ``value``, ``minimum``, or
+        ``maximum``).
+    :return: the number or ``None`` if the key is missing or the value is not
+        a single number (e.g. a string, a waveform, or a boolean).
+    """
+    value = sample.get(key)
+    if not isinstance(value, list) or len(value) != 1:
+        return None
+    value = value[0]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
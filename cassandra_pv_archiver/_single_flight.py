@@ -0,0 +1,96 @@
+"""
+Coalescing of identical concurrent requests.
+
+When several threads ask for the same resource at the same time, only the
+first one actually sends a request. The other threads wait for that request to
+finish and get the same result (or a copy of the same exception, which is
+chained to the original one).
+"""
+
+import copy
+import threading
+
+from cassandra_pv_archiver import _deadline
+
+
+class SingleFlight(object):
+    """
+    Group of calls, where concurrent calls with the same key share a single
+    execution.
+
+    The result of a call is only shared with calls that arrive while it is in
+    progress. It is not cached beyond that.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, deadline=None):
+        """
+        Run a function unless a call with the same key is already in progress.
+
+        :param key:
+            hashable object identifying the call.
+        :param func:
+            function (without arguments) that is run if there is no call in
+            progress for the key.
+        :param deadline:
+            deadline (as used by the ``_deadline`` module) until which this
+            method waits for a call that is already in progress. If it passes,
+            a ``TimeoutError`` is raised. ``None`` (the default) means that
+            this method waits indefinitely.
+        :return:
+            result of the function. If the call was coalesced with a call that
+            was already in progress, this is the same object that is returned
+            to the other caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(_deadline.remaining(deadline)):
+                raise TimeoutError('Deadline exceeded')
+            if call.exception is not None:
+                # Raising the same exception object in several threads would
+                # mix up their tracebacks, so each thread gets its own copy.
+                raise _copy_exception(call.exception) from call.exception
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _Call(object):
+    """
+    State of a call that is in progress.
+    """
+
+    __slots__ = ('done', 'exception', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.exception = None
+        self.result = None
+
+
+def _copy_exception(exception):
+    """
+    Return a new exception of the same type and with the same arguments as the
+    specified one. If the exception cannot be copied, a plain ``Exception``
+    with the same message is returned instead.
+    """
+    # noinspection PyBroadException
+    try:
+        return copy.copy(exception)
+    except Exception:
+        return Exception(str(exception))
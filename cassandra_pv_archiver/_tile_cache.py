@@ -0,0 +1,210 @@
+"""
+Tile-based cache for decimated sample queries.
+
+Queries with arbitrary start times, end times, and counts hardly ever repeat
+exactly. The tile cache therefore maps each query to a resolution (a power of
+two nanoseconds per sample) and to the aligned time tiles that cover the
+requested range at that resolution. Whole tiles are fetched and cached, and the
+answer is assembled from the cached tiles. This way, queries for similar
+ranges are mostly served from memory.
+"""
+
+import bisect
+import collections
+import concurrent.futures
+import threading
+import time
+
+from cassandra_pv_archiver import _deadline
+from cassandra_pv_archiver import _single_flight
+
+
+class TileCache(object):
+    """
+    Cache for the samples of decimated queries, organized in aligned tiles.
+
+    Tiles that extend into the future (relative to the local clock) are used
+    for the query that fetched them, but not cached, because they are still
+    going to change.
+    """
+
+    def __init__(self, fetch, make_url, tile_samples=256, max_tiles=4096,
+                 max_workers=4, max_tiles_per_query=64):
+        """
+        Create a tile cache.
+
+        :param fetch:
+            function that takes a URL and a deadline and returns the decoded
+            response.
+        :param make_url:
+            function that takes a channel name, a start time, an end time, and
+            a count and returns the URL for the respective query.
+        :param tile_samples:
+            number of samples that are requested for each tile.
+        :param max_tiles:
+            maximum number of tiles that are kept. When this number is
+            exceeded, the least recently used tile is discarded.
+        :param max_workers:
+            maximum number of tiles that are fetched in parallel.
+        :param max_tiles_per_query:
+            queries that would need more tiles are sent to the server
+            directly.
+        """
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._make_url = make_url
+        self._max_tiles = max_tiles
+        self._max_tiles_per_query = max_tiles_per_query
+        self._single_flight = _single_flight.SingleFlight()
+        self._stopped = False
+        self._tile_samples = tile_samples
+        self._tiles = collections.OrderedDict()
+
+    def clear(self):
+        """
+        Discard all cached tiles.
+        """
+        with self._lock:
+            self._tiles.clear()
+
+    def get(self, channel_name, start_time, end_time, count, deadline=None):
+        """
+        Return the samples for a decimated query.
+
+        The result follows the same rules as a response from the server: it
+        contains all samples in the requested range and, unless there are
+        samples exactly at the start or the end of the range, the last sample
+        before the start and the first sample after the end.
+
+        If the deadline passes before all tiles are available, a
+        ``TimeoutError`` is raised.
+        """
+        width = end_time - start_time
+        if width <= 0 or count <= 0:
+            return self._fetch(
+                self._make_url(channel_name, start_time, end_time, count),
+                deadline)
+        # We round the resolution down to a power of two, so that the result
+        # never has fewer samples than requested.
+        level = max(1, width // count).bit_length() - 1
+        tile_width = self._tile_samples << level
+        first_tile = start_time // tile_width
+        last_tile = end_time // tile_width
+        if last_tile - first_tile + 1 > self._max_tiles_per_query:
+            return self._fetch(
+                self._make_url(channel_name, start_time, end_time, count),
+                deadline)
+        tile_indices = range(first_tile, last_tile + 1)
+        # The tasks are submitted while holding the lock, so that shutdown
+        # cannot stop the executor in between. After a shutdown, queries that
+        # are still in progress are sent to the server directly.
+        with self._lock:
+            if self._stopped:
+                futures = None
+            else:
+                futures = [
+                    self._executor.submit(
+                        self._get_tile, channel_name, level, tile_width, index,
+                        deadline)
+                    for index in tile_indices[1:]
+                ]
+        if futures is None:
+            return self._fetch(
+                self._make_url(channel_name, start_time, end_time, count),
+                deadline)
+        # The first tile is fetched in the calling thread, so that we do not
+        # have to wait for a worker for the common case of a single tile.
+        tiles = [self._get_tile(
+            channel_name, level, tile_width, tile_indices[0], deadline)]
+        tiles.extend(
+            future.result(_deadline.remaining(deadline)) for future in futures)
+        return _assemble(tiles, start_time, end_time)
+
+    def shutdown(self):
+        """
+        Stop the worker threads and discard all cached tiles.
+
+        Queries that arrive after (or while) the cache is shut down are sent to
+        the server directly.
+        """
+        with self._lock:
+            self._stopped = True
+        self._executor.shutdown(wait=False)
+        self.clear()
+
+    def _get_tile(self, channel_name, level, tile_width, index, deadline):
+        """
+        Return a tile from the cache or fetch it from the server.
+
+        :return: tuple of the last sample before the tile (or ``None``), the
+            list of samples in the tile, and the first sample after the tile
+            (or ``None``).
+        """
+        key = (channel_name, level, index)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+
+        def load():
+            tile_start = index * tile_width
+            tile_end = tile_start + tile_width
+            samples = self._fetch(
+                self._make_url(
+                    channel_name, tile_start, tile_end, self._tile_samples),
+                deadline)
+            loaded_tile = _split_tile(samples, tile_start, tile_end)
+            if tile_end <= time.time_ns():
+                with self._lock:
+                    self._tiles[key] = loaded_tile
+                    while len(self._tiles) > self._max_tiles:
+                        self._tiles.popitem(last=False)
+            return loaded_tile
+
+        return self._single_flight.do(key, load, deadline)
+
+
+def _assemble(tiles, start_time, end_time):
+    """
+    Assemble the answer for a query from the tiles that cover its range.
+    """
+    samples = []
+    before, _, _ = tiles[0]
+    if before is not None:
+        samples.append(before)
+    for _, tile_samples, _ in tiles:
+        samples.extend(tile_samples)
+    _, _, after = tiles[-1]
+    if after is not None:
+        samples.append(after)
+    times = [sample['time'] for sample in samples]
+    low = bisect.bisect_left(times, start_time)
+    if low > 0 and (low == len(times) or times[low] != start_time):
+        low -= 1
+    high = bisect.bisect_right(times, end_time)
+    if high < len(times) and (high == 0 or times[high - 1] != end_time):
+        high += 1
+    return samples[low:high]
+
+
+def _split_tile(samples, tile_start, tile_end):
+    """
+    Split the response for a tile into the sample before the tile, the samples
+    in the tile, and the sample after the tile.
+    """
+    before = None
+    after = None
+    tile_samples = []
+    for sample in samples:
+        sample_time = sample['time']
+        if sample_time < tile_start:
+            before = sample
+        elif sample_time >= tile_end:
+            if after is None:
+                after = sample
+        else:
+            tile_samples.append(sample)
+    return before, tile_samples, after
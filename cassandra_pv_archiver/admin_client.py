@@ -8,8 +8,29 @@ import gzip
 from http import HTTPStatus
 import io
 import json
+import os
 import urllib.error
 import urllib.request
+import zlib
+
+from cassandra_pv_archiver import _deadline
+from cassandra_pv_archiver import _json_stream
+from cassandra_pv_archiver import _single_flight
+
+_ENCODE_CACHE_SIZE = 65536
+
+_encode_cache = {}
+
+# Maps each byte value to its encoded representation. Letters, digits, "-",
+# and "_" are used as they are, all other bytes are represented by a tilde
+# followed by two (uppercase) hexadecimal digits.
+_ENCODE_TRANSLATION_TABLE = [
+    chr(b) if (b == 0x2d or b == 0x5f or (0x30 <= b <= 0x39)
+               or (0x41 <= b <= 0x5a) or (0x61 <= b <= 0x7a))
+    else '~{0:02X}'.format(b)
+    for b in range(256)]
+
+_STREAMING_BODY_CHUNK_SIZE = 3 * 16384
 
 
 class AdminClient(object):
@@ -22,7 +43,9 @@ class AdminClient(object):
                  server_name,
                  server_port=4812,
                  username='admin',
-                 password=''):
+                 password='',
+                 coalesce_requests=False,
+                 timeout=None):
         """
         Create a web-service client.
 
@@ -48,6 +71,19 @@ class AdminClient(object):
         :param password:
             password to be used for action that require authentication. The
             default is the empty string.
+        :param coalesce_requests:
+            coalesce identical concurrent read requests? If ``True``, threads
+            that call one of the ``get_*`` or ``list_*`` methods with the same
+            parameters while such a call is already in progress wait for that
+            call and get the same result instead of sending their own request.
+            The returned objects are shared between these threads, so they
+            must not be modified. Default is ``False``.
+        :param timeout:
+            default for the maximum time (in seconds) that each operation may
+            take, including receiving and decoding the response. An operation
+            that takes longer fails with a ``TimeoutError``. Each method
+            accepts a ``timeout`` parameter that overrides this default. If
+            ``None`` (the default), operations never time out.
         """
         self._protocol_version = '1.0'
         self._base_url = 'http://{0}:{1}/admin/api/{2}'.format(
@@ -55,14 +91,26 @@ class AdminClient(object):
         self._username = username
         self._password = password
         self._auth_header = self._generate_auth_header()
+        self._single_flight = (
+            _single_flight.SingleFlight() if coalesce_requests else None)
+        self._timeout = timeout
 
-    def export_server_configuration(self, server_id, configuration_file=None):
+    def export_server_configuration(self,
+                                    server_id,
+                                    configuration_file=None,
+                                    timeout=None):
         """
         Export server configuration into a file.
 
         If no path to a configuration file is specified, the file contents are
         returned by this method (as binary data).
 
+        The configuration is decoded from the server response while the
+        response is being received and written to the file immediately, so
+        the memory consumption does not depend on the size of the
+        configuration. If an error occurs while receiving the configuration, a
+        partially written file is removed again.
+
         This method raises an exception if it cannot get the configuration from
         the server or cannot write it to the specified file.
 
@@ -70,33 +118,51 @@ class AdminClient(object):
             UUID of the server for which the configuration shall be exported.
         :param configuration_file:
             path to the file into which the configuration shall be written. If
-            ``None`` (the default), the configuration contents are returned by
-            this method instead of writing them to a file.
+            this is a writable binary file-like object (an object with a
+            ``write`` method) instead of a path, the configuration is written
+            to that object. If ``None`` (the default), the configuration
+            contents are returned by this method instead of writing them to a
+            file.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             configuration file contents if ``configuration_file`` is ``None``.
-            ``None`` if the path to a configuration file is specified.
+            ``None`` if the path to a configuration file or a file-like object
+            is specified.
         """
         req = self._req('/channels/by-server/{0}/export'.format(server_id))
-        resp_data = None  # Needed so that we do not get a warning.
-        with self._do_req(req) as resp:
+        with self._do_req(req, self._deadline_for(timeout)) as resp:
             status_code = resp.code
             if status_code == HTTPStatus.SERVICE_UNAVAILABLE:
                 raise Exception('Service currently not available')
             elif not self._is_success_code(resp.code):
                 raise Exception('Request failed with status code {0}'.format(
                     resp.code))
-            resp_data = self._get_resp_data(resp)
-        config_file_contents = base64.b64decode(
-            resp_data['configurationFile'].encode(encoding='ascii'),
-            validate=True)
-        if configuration_file is None:
-            return config_file_contents
-        else:
-            with io.BufferedWriter(open(configuration_file, 'wb')) as file:
-                file.write(config_file_contents)
-            return None
-
-    def get_channel(self, channel_name, server_id=None):
+            if configuration_file is None:
+                target = io.BytesIO()
+                self._write_configuration_file(resp, target)
+                return target.getvalue()
+            elif hasattr(configuration_file, 'write'):
+                self._write_configuration_file(resp, configuration_file)
+                return None
+            else:
+                # If the file cannot be opened, the exception is raised
+                # directly, so that we never remove a file that we did not
+                # write.
+                with open(configuration_file, 'wb') as file:
+                    try:
+                        self._write_configuration_file(resp, file)
+                    except BaseException:
+                        # We do not want to leave a truncated configuration
+                        # file.
+                        file.close()
+                        os.remove(configuration_file)
+                        raise
+                return None
+
+    def get_channel(self, channel_name, server_id=None, timeout=None):
         """
         Get configuration and status information for a channel.
 
@@ -105,6 +171,10 @@ class AdminClient(object):
         :param server_id:
             optional server ID. If specified, the channel information is only
             returned when the channel currently belongs to that server.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             dictionary that is a verbatim copy of the server response (JSON
             converted to Python data-types).
@@ -115,46 +185,77 @@ class AdminClient(object):
         else:
             url = '/channels/by-server/{0}/by-name/{1}/'.format(
                 server_id, channel_name)
-        req = self._req(url)
-        with self._do_req(req) as resp:
-            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            if not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            return self._get_resp_data(resp)
+        return self._get_json(url, self._deadline_for(timeout))
 
-    def get_cluster_status(self):
+    def get_cluster_status(self, timeout=None):
         """
         Get status information for the archive cluster.
 
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             dictionary that is a verbatim copy of the server response (JSON
             converted to Python data-types).
         """
-        req = self._req('/cluster-status/')
-        with self._do_req(req) as resp:
-            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            if not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            return self._get_resp_data(resp)
+        return self._get_json(
+            '/cluster-status/', self._deadline_for(timeout))
 
-    def get_server_status(self):
+    def get_raw_cluster_status(self, timeout=None):
+        """
+        Get status information for the archive cluster as the undecoded JSON
+        document.
+
+        This is useful for detecting changes cheaply (by comparing the
+        document with the previous one) before decoding it.
+
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving the response. If ``None`` (the default), the timeout
+            specified when creating the client is used.
+        :return:
+            tuple of the JSON document (as ``bytes``) and its charset.
+        """
+        return self._get_raw_json(
+            '/cluster-status/', self._deadline_for(timeout))
+
+    def get_raw_server_status(self, timeout=None):
+        """
+        Get status information for the server as the undecoded JSON
+        document.
+
+        This is useful for detecting changes cheaply (by comparing the
+        document with the previous one) before decoding it.
+
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving the response. If ``None`` (the default), the timeout
+            specified when creating the client is used.
+        :return:
+            tuple of the JSON document (as ``bytes``) and its charset.
+        """
+        return self._get_raw_json(
+            '/server-status/this-server/', self._deadline_for(timeout))
+
+    def get_server_status(self, timeout=None):
         """
         Get status information for the server.
 
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             dictionary that is a verbatim copy of the server response (JSON
             converted to Python data-types).
         """
-        req = self._req('/server-status/this-server/')
-        with self._do_req(req) as resp:
-            if not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            return self._get_resp_data(resp)
+        # This method has always reported an unavailable service like any other
+        # failure, and callers might rely on the message.
+        return self._get_json(
+            '/server-status/this-server/',
+            self._deadline_for(timeout),
+            check_service_unavailable=False)
 
     def import_server_configuration(self,
                                     server_id,
@@ -162,7 +263,9 @@ class AdminClient(object):
                                     add_channels=True,
                                     remove_channels=False,
                                     update_channels=True,
-                                    simulate=False):
+                                    simulate=False,
+                                    compress_request=False,
+                                    timeout=None):
         """
         Import a channel configuration file for a specific server.
 
@@ -182,12 +285,18 @@ class AdminClient(object):
         not result in an exception. Instead, an error message for the affected
         channels is returned as part of the result object.
 
+        The request body is generated while it is being sent: the
+        configuration file is read and base64-encoded chunk by chunk, so the
+        file is never held in memory completely.
+
         :param server_id:
             UUID of the server for which the configuration shall be imported.
         :param configuration_file:
             path to the configuration file that shall be imported.
             If this is a binary (bytes) object instead of a string, it is
-            interpreted as the file contents and used directly instead.
+            interpreted as the file contents and used directly instead. If
+            this is a readable binary file-like object (an object with a
+            ``read`` method), the file contents are read from that object.
         :param add_channels:
             add new channels to the server? If ``True``, channels that exist in
             the configuration file, but not on the server are added to the
@@ -215,25 +324,51 @@ class AdminClient(object):
             simulation is not complete, actually applying the changes might
             result in failures for channels that were reported as successful in
             the simulation.
+        :param compress_request:
+            compress the request body with gzip? This reduces the amount of
+            data sent for large configuration files, but only works if the
+            server (or a proxy in front of it) accepts gzip-encoded requests.
+            Default is ``False``.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             dictionary that is a verbatim copy of the server response (JSON
             converted to Python data-types).
         """
         url = '/channels/by-server/{0}/import'.format(server_id)
-        if isinstance(configuration_file, bytes):
-            config_data = base64.b64encode(configuration_file)
-        else:
-            with open(configuration_file, mode='rb') as file:
-                config_data = base64.b64encode(file.read())
         req_data = {
             'addChannels': add_channels,
-            'configurationFile': config_data.decode(encoding='ascii'),
             'removeChannels': remove_channels,
             'simulate': simulate,
             'updateChannels': update_channels
         }
-        req = self._req(url, req_data, method='POST', authenticate=True)
-        with self._do_req(req) as resp:
+        if isinstance(configuration_file, bytes):
+            config_stream = io.BytesIO(configuration_file)
+            config_size = len(configuration_file)
+        elif hasattr(configuration_file, 'read'):
+            config_stream = configuration_file
+            config_size = None
+        else:
+            config_stream = open(configuration_file, mode='rb')
+            config_size = os.fstat(config_stream.fileno()).st_size
+        try:
+            body, content_length = _make_streaming_json_body(
+                req_data, 'configurationFile', config_stream, config_size)
+            headers = {}
+            if compress_request:
+                body = _gzip_chunks(body)
+                headers['Content-Encoding'] = 'gzip'
+            elif content_length is not None:
+                headers['Content-Length'] = str(content_length)
+            req = self._req(url, headers=headers, body=body, method='POST',
+                            authenticate=True)
+            resp = self._do_req(req, self._deadline_for(timeout))
+        finally:
+            if config_stream is not configuration_file:
+                config_stream.close()
+        with resp:
             status_code = resp.code
             if status_code == HTTPStatus.FORBIDDEN:
                 raise Exception('Authentication error')
@@ -260,7 +395,70 @@ class AdminClient(object):
                 raise Exception(resp_data['errorMessage'])
             return resp_data
 
-    def list_all_channels(self):
+    def iter_all_channels(self, batch_size=None, timeout=None):
+        """
+        Iterate over all channels that exist in the cluster.
+
+        In contrast to ``list_all_channels``, the channels are decoded while
+        the response is being received, so that the memory consumption does
+        not depend on the number of channels and processing can start before
+        the whole response has arrived.
+
+        The request is only sent when the iteration starts, so exceptions are
+        raised when retrieving the first element. The timeout starts at the
+        same time, but the time spent processing the elements while iterating
+        counts against it, because the response is still being received.
+
+        :param batch_size:
+            if ``None`` (the default), the channels are returned one by one.
+            Otherwise, they are returned in lists of (at most) the specified
+            number of channels.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
+        :return:
+            iterator over the channels (or lists of channels if
+            ``batch_size`` is specified). Each of the channels is a dictionary
+            storing information about a single channel.
+        """
+        return self._iter_channels('/channels/all/', batch_size, timeout)
+
+    def iter_channels_for_server(self, server_id, batch_size=None,
+                                 timeout=None):
+        """
+        Iterate over all channels for a specific server.
+
+        This is the streaming variant of ``list_channels_for_server``. The
+        channels are decoded while the response is being received, so that
+        the memory consumption does not depend on the number of channels.
+
+        The request is only sent when the iteration starts, so exceptions are
+        raised when retrieving the first element. The timeout starts at the
+        same time, but the time spent processing the elements while iterating
+        counts against it, because the response is still being received.
+
+        :param server_id:
+            UUID of the server for which the channels shall be listed.
+        :param batch_size:
+            if ``None`` (the default), the channels are returned one by one.
+            Otherwise, they are returned in lists of (at most) the specified
+            number of channels.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
+        :return:
+            iterator over the channels (or lists of channels if
+            ``batch_size`` is specified). Each of the channels is a dictionary
+            storing information about a single channel.
+        """
+        return self._iter_channels(
+            '/channels/by-server/{0}/'.format(server_id),
+            batch_size,
+            timeout)
+
+    def list_all_channels(self, timeout=None):
         """
         List all channels that exist in the cluster.
 
@@ -268,21 +466,18 @@ class AdminClient(object):
         about each channel. In order to get more detailed information, use the
         ``list_channels_for_server`` method.
 
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             list with an element for each channel. Each of the elements is a
             dictionary storing information about a single channel.
         """
-        req = self._req('/channels/all/')
-        with self._do_req(req) as resp:
-            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            if not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            resp_data = self._get_resp_data(resp)
-            return resp_data['channels']
+        return self._get_json(
+            '/channels/all/', self._deadline_for(timeout))['channels']
 
-    def list_channels_for_server(self, server_id):
+    def list_channels_for_server(self, server_id, timeout=None):
         """
         List all channels for a specific server.
 
@@ -291,21 +486,19 @@ class AdminClient(object):
 
         :param server_id:
             UUID of the server for which the channels shall be listed.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             list with an element for each channel. Each of the elements is a
             dictionary storing information about a single channel.
         """
-        req = self._req('/channels/by-server/{0}/'.format(server_id))
-        with self._do_req(req) as resp:
-            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            if not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            resp_data = self._get_resp_data(resp)
-            return resp_data['channels']
+        return self._get_json(
+            '/channels/by-server/{0}/'.format(server_id),
+            self._deadline_for(timeout))['channels']
 
-    def run_archive_configuration_commands(self, commands):
+    def run_archive_configuration_commands(self, commands, timeout=None):
         """
         Run a list of archive configuration commands.
 
@@ -321,6 +514,10 @@ class AdminClient(object):
         :param commands:
             list of archive configuration commands. The easiest way of creating
             such a list is using the ``ArchiveConfigurationCommands`` class.
+        :param timeout:
+            maximum time (in seconds) for the whole operation, including
+            receiving and decoding the response. If ``None`` (the default), the
+            timeout specified when creating the client is used.
         :return:
             list that contains an element for each command. Each of these
             elements is a dict that represents the result of executing the
@@ -339,7 +536,7 @@ class AdminClient(object):
         }
         req = self._req('/run-archive-configuration-commands',
                         req_data, method='POST', authenticate=True)
-        with self._do_req(req) as resp:
+        with self._do_req(req, self._deadline_for(timeout)) as resp:
             status_code = resp.code
             if status_code == HTTPStatus.FORBIDDEN:
                 raise Exception('Authentication error')
@@ -366,16 +563,24 @@ class AdminClient(object):
                 raise Exception(resp_data['errorMessage'])
             return resp_data['results']
 
+    def _deadline_for(self, timeout):
+        """
+        Return the deadline for an operation with the specified timeout (or the
+        default timeout if ``timeout`` is ``None``).
+        """
+        return _deadline.from_timeout(
+            timeout if timeout is not None else self._timeout)
+
     @staticmethod
-    def _do_req(req):
+    def _do_req(req, deadline=None):
         """
         Send a request object and return the response. If an `HTTPError` is
         raised, it is caught and returned instead of the response object.
+
+        If a deadline is specified, reading the response fails with a
+        ``TimeoutError`` once the deadline has passed.
         """
-        try:
-            return urllib.request.urlopen(req)
-        except urllib.error.HTTPError as err:
-            return err
+        return _deadline.urlopen(req, deadline)
 
     def _generate_auth_header(self):
         """
@@ -404,10 +609,78 @@ class AdminClient(object):
         charset = extra_args.get('charset', None)
         return content_type, charset
 
+    def _get_json(self, url, deadline=None, check_service_unavailable=True):
+        """
+        Send a GET request for the specified URL and return the decoded JSON
+        response.
+
+        If request coalescing is enabled, concurrent calls for the same URL
+        share a single request and its result. If
+        ``check_service_unavailable`` is ``False``, a 503 status code is
+        reported like any other status code that indicates a failure.
+        """
+        def fetch():
+            req = self._req(url)
+            with self._do_req(req, deadline) as resp:
+                if (check_service_unavailable
+                        and resp.code == HTTPStatus.SERVICE_UNAVAILABLE):
+                    raise Exception('Service currently not available')
+                if not self._is_success_code(resp.code):
+                    raise Exception(
+                        'Request failed with status code {0}'.format(
+                            resp.code))
+                return self._get_resp_data(resp)
+        if self._single_flight is None:
+            return fetch()
+        return self._single_flight.do(url, fetch, deadline)
+
+    def _get_raw_json(self, url, deadline=None):
+        """
+        Send a GET request for the specified URL and return the undecoded JSON
+        response as a tuple of the body and its charset.
+        """
+        req = self._req(url)
+        with self._do_req(req, deadline) as resp:
+            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
+                raise Exception('Service currently not available')
+            if not self._is_success_code(resp.code):
+                raise Exception('Request failed with status code {0}'.format(
+                    resp.code))
+            return self._get_resp_body(resp)
+
+    def _get_resp_body(self, resp):
+        """
+        Read and return the (decompressed) body of a JSON response.
+
+        Raises an exception if the response does not have the expected content
+        type (``application/json``).
+
+        :return: tuple of the body (as ``bytes``) and its charset.
+        """
+        content_type, charset = self._get_content_type_and_charset(resp)
+        if content_type != 'application/json':
+            raise Exception(
+                'Expected content-type application/json, but got {0}.'.format(
+                    content_type))
+        body = resp.read()
+        if resp.headers.get('Content-Encoding', None) == 'gzip':
+            body = gzip.decompress(body)
+        return body, charset or 'utf_8'
+
     def _get_resp_data(self, resp):
         """
         Read and return JSON data from a response.
 
+        Raises an exception if the response does not have the expected content
+        type (``application/json``).
+        """
+        return json.load(self._get_resp_text_stream(resp))
+
+    def _get_resp_text_stream(self, resp):
+        """
+        Return a text stream for reading the JSON data from a response.
+
+        The stream takes care of decompressing the response if necessary.
         Raises an exception if the response does not have the expected content
         type (``application/json``).
         """
@@ -425,7 +698,7 @@ class AdminClient(object):
             file_object = gzip.GzipFile(fileobj=resp)
         else:
             file_object = resp
-        return json.load(io.TextIOWrapper(file_object, encoding=charset))
+        return io.TextIOWrapper(file_object, encoding=charset)
 
     @staticmethod
     def _is_success_code(status_code):
@@ -435,25 +708,61 @@ class AdminClient(object):
         """
         return (status_code >= 200) and (status_code < 300)
 
+    def _iter_channels(self, url, batch_size, timeout=None):
+        """
+        Request a channel list from the specified URL and iterate over the
+        channels while the response is being received.
+
+        The deadline is only calculated when the iteration starts, so the time
+        between creating the iterator and retrieving the first element does
+        not count against the timeout.
+        """
+        req = self._req(url)
+        with self._do_req(req, self._deadline_for(timeout)) as resp:
+            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
+                raise Exception('Service currently not available')
+            if not self._is_success_code(resp.code):
+                raise Exception('Request failed with status code {0}'.format(
+                    resp.code))
+            channels = _json_stream.iter_array(
+                self._get_resp_text_stream(resp), 'channels')
+            if batch_size is None:
+                yield from channels
+                return
+            batch = []
+            for channel in channels:
+                batch.append(channel)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
     # noinspection PyDefaultArgument
     def _req(self,
              url,
              data=None,
              headers={},
              method='GET',
-             authenticate=False):
+             authenticate=False,
+             body=None):
         """
         Creates and returns a request object.
 
         This method takes care of converting the supplied data object to JSON,
         setting the appropriate request headers and including an authorization
         header (if requested).
+
+        Instead of a data object, an already JSON-encoded body can be passed.
+        It may be an iterable of byte chunks, which are sent as they are
+        generated (using chunked transfer encoding unless a
+        ``Content-Length`` header is specified).
         """
         req_url = self._base_url + url
         if data is not None:
             req_data = json.dumps(data).encode()
         else:
-            req_data = None
+            req_data = body
         req_headers = {
             'Accept': 'application/json',
             'Accept-Encoding': 'gzip'
@@ -466,6 +775,30 @@ class AdminClient(object):
         return urllib.request.Request(
             req_url, req_data, req_headers, method=method)
 
+    def _write_configuration_file(self, resp, target):
+        """
+        Decode the configuration file from an export response and write it to
+        the target file object.
+
+        The base64-encoded file contents are decoded chunk by chunk while
+        reading the response.
+        """
+        remainder = ''
+        for chunk in _json_stream.iter_string(
+                self._get_resp_text_stream(resp), 'configurationFile'):
+            chunk = remainder + chunk
+            # Base64 data can only be decoded in blocks of four characters,
+            # so we keep an incomplete block until the next chunk arrives.
+            usable_length = len(chunk) - len(chunk) % 4
+            remainder = chunk[usable_length:]
+            if usable_length:
+                target.write(base64.b64decode(
+                    chunk[:usable_length].encode(encoding='ascii'),
+                    validate=True))
+        if remainder:
+            raise Exception(
+                'Malformed configuration file data in response.')
+
 
 class ArchiveConfigurationCommands(list):
     """
@@ -817,36 +1150,119 @@ class ArchiveConfigurationCommands(list):
         self.append(command)
 
 
+def encode_many(uri_parts):
+    """
+    Encode a sequence of URI parts (typically channel names) in the way
+    expected by certain API functions.
+
+    This is the bulk variant of the encoding that is applied to channel names
+    by methods like ``get_channel``. It is useful when building URLs for a
+    large number of channels.
+
+    :param uri_parts:
+        iterable of strings to be encoded.
+    :return:
+        list with the encoded strings (in the same order).
+    """
+    return list(map(_encode_uri_part_custom, uri_parts))
+
+
 def _encode_uri_part_custom(uri_part):
     """
     Encode the URI part in the way expected by certain API functions.
 
     This is very similar to a regular URI encode, but encodes more characters
     and uses the tilde instead of the percent sign for escaping.
+
+    The results are cached because the same channel names tend to be encoded
+    over and over again. The cache is simply cleared when it is full, which is
+    much cheaper than tracking the least recently used entries.
     :param uri_part:
         string to be encoded.
     :return:
         encoded string.
     """
-    bin_data = uri_part.encode('utf_8')
-    encoded_bin_data = bytearray()
-    for b in bin_data:
-        if (b == 0x2d or b == 0x5f or (0x30 <= b <= 0x39)
-                or (0x41 <= b <= 0x5a) or (0x61 <= b <= 0x7a)):
-            encoded_bin_data.append(b)
-        else:
-            # This code looks a bit strange, but effectively it converts a byte
-            # to a three byte sequence, where the first byte is the ASCII code
-            # for the tilde and the other two bytes represent a hexadecimal
-            # number (in ASCII) that represents the value of the original byte.
-            high = b // 16
-            low = b % 16
-            high_b = (0x30 + high) if high < 10 else (0x37 + high)
-            low_b = (0x30 + low) if low < 10 else (0x37 + low)
-            encoded_bin_data.append(0x7e)
-            encoded_bin_data.append(high_b)
-            encoded_bin_data.append(low_b)
-    return encoded_bin_data.decode('ascii')
+    encoded = _encode_cache.get(uri_part)
+    if encoded is not None:
+        return encoded
+    if uri_part.isascii():
+        # For ASCII strings, each character corresponds to exactly one byte,
+        # so we can use the (much faster) translate method of str.
+        encoded = uri_part.translate(_ENCODE_TRANSLATION_TABLE)
+    else:
+        encoded = ''.join([
+            _ENCODE_TRANSLATION_TABLE[b] for b in uri_part.encode('utf_8')])
+    if len(_encode_cache) >= _ENCODE_CACHE_SIZE:
+        _encode_cache.clear()
+    _encode_cache[uri_part] = encoded
+    return encoded
+
+
+def _gzip_chunks(chunks):
+    """
+    Compress a sequence of byte chunks with gzip.
+
+    :param chunks:
+        iterable of ``bytes`` objects.
+    :return:
+        iterator over the ``bytes`` objects that form the compressed data.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    yield compressor.flush()
+
+
+def _make_streaming_json_body(obj, binary_key, stream, size=None):
+    """
+    Create a JSON request body that contains base64-encoded data from a stream.
+
+    The body is generated lazily, so that the data is read from the stream and
+    encoded chunk by chunk while the body is being sent.
+
+    :param obj:
+        dict with the other fields of the JSON object.
+    :param binary_key:
+        key under which the base64-encoded data is stored in the JSON object.
+    :param stream:
+        readable binary file-like object providing the data.
+    :param size:
+        number of bytes that will be read from the stream or ``None`` if that
+        number is not known.
+    :return:
+        tuple of an iterator over the ``bytes`` objects that form the body and
+        the total length of the body (``None`` if ``size`` is ``None``).
+    """
+    prefix = json.dumps(obj)[:-1]
+    if obj:
+        prefix += ', '
+    prefix = (prefix + json.dumps(binary_key) + ': "').encode()
+    suffix = b'"}'
+    if size is None:
+        content_length = None
+    else:
+        content_length = (
+            len(prefix) + 4 * ((size + 2) // 3) + len(suffix))
+
+    def generate():
+        yield prefix
+        while True:
+            # The chunk size must be a multiple of three so that no padding is
+            # inserted between chunks.
+            chunk = stream.read(_STREAMING_BODY_CHUNK_SIZE)
+            if not chunk:
+                break
+            while len(chunk) % 3 != 0:
+                extra_data = stream.read(3 - len(chunk) % 3)
+                if not extra_data:
+                    break
+                chunk += extra_data
+            yield base64.b64encode(chunk)
+        yield suffix
+
+    return generate(), content_length
 
 
 def _make_str(obj):
@@ -876,7 +1292,7 @@ def _make_str_dict(dict_like_obj):
         are converted to strings.
     """
     return {
-        str(key): str(value) for key, value in dict_like_obj.items
+        str(key): str(value) for key, value in dict_like_obj.items()
         } if dict_like_obj is not None else None
 
 
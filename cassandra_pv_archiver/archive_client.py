@@ -3,14 +3,31 @@ Web-service client for the administrative interface of the Cassandra PV
 Archiver.
 """
 
+import concurrent.futures
 import gzip
 from http import HTTPStatus
 import io
 import json
-import urllib.error
+import re
 import urllib.parse
 import urllib.request
 
+from cassandra_pv_archiver import _deadline
+from cassandra_pv_archiver import _hedging
+from cassandra_pv_archiver import _json_stream
+from cassandra_pv_archiver import _prefetch
+from cassandra_pv_archiver import _process_decode
+from cassandra_pv_archiver import _single_flight
+from cassandra_pv_archiver import _tile_cache
+from cassandra_pv_archiver import sample_arrays
+from cassandra_pv_archiver import sample_statistics
+from cassandra_pv_archiver import threshold_scan
+
+# Maximum length of the (URL-encoded) regular expression that is sent in a
+# single request by ``find_channels_by_patterns``. Many servers and proxies
+# reject request lines longer than a few kilobytes.
+_MAX_REGEXP_URL_LENGTH = 4000
+
 
 class ArchiveClient(object):
     """
@@ -20,7 +37,11 @@ class ArchiveClient(object):
 
     def __init__(self,
                  server_name,
-                 server_port=9812):
+                 server_port=9812,
+                 coalesce_requests=False,
+                 timeout=None,
+                 hedge_servers=None,
+                 hedge_delay=None):
         """
         Create a web-service client.
 
@@ -38,12 +59,182 @@ class ArchiveClient(object):
         :param server_port:
             port number on which the archive-access interface of the Cassandra
             PV Archiver server is available. The default is 9812.
+        :param coalesce_requests:
+            coalesce identical concurrent requests? If ``True``, threads that
+            request exactly the same data (e.g. the samples for the same
+            channel and time range) while such a request is already in progress
+            wait for that request and get the same result instead of sending
+            their own request. The returned objects are shared between these
+            threads, so they must not be modified. Default is ``False``.
+        :param timeout:
+            default for the maximum time (in seconds) that each operation may
+            take, including receiving and decoding the response. An operation
+            that takes longer fails with a ``TimeoutError``. Each method
+            accepts a ``timeout`` parameter that overrides this default. If
+            ``None`` (the default), operations never time out.
+        :param hedge_servers:
+            other servers of the same cluster that are used for hedged
+            requests. Each element is either a hostname (using the same port
+            as the primary server) or a tuple of a hostname and a port. If no
+            response from the primary server has arrived after the hedge delay,
+            the same request is sent to one of these servers (using them in
+            turn), and whichever response arrives first is used. If ``None``
+            or empty (the default), requests are not hedged.
+        :param hedge_delay:
+            delay (in seconds) after which a hedge request is sent. If ``None``
+            (the default), the 95th percentile of the latencies of recent
+            requests is used.
         """
         self._protocol_version = '1.0'
         self._base_url = 'http://{0}:{1}/archive-access/api/{2}'.format(
             server_name, server_port, self._protocol_version)
+        self._hedger = None
+        self._prefetcher = None
+        self._process_decoder = None
+        self._single_flight = (
+            _single_flight.SingleFlight() if coalesce_requests else None)
+        self._tile_cache = None
+        self._timeout = timeout
+        # The base URLs of all servers that can be used for hedged requests.
+        # The first one is the base URL of the primary server.
+        self._base_urls = [self._base_url]
+        for hedge_server in (hedge_servers or []):
+            if isinstance(hedge_server, str):
+                hedge_server = (hedge_server, server_port)
+            self._base_urls.append(
+                'http://{0}:{1}/archive-access/api/{2}'.format(
+                    hedge_server[0], hedge_server[1], self._protocol_version))
+        if len(self._base_urls) > 1:
+            self._hedger = _hedging.Hedger(
+                len(self._base_urls), hedge_delay=hedge_delay)
+
+    def disable_prefetch(self):
+        """
+        Disable prefetching of samples.
+
+        This stops the background threads and discards all prefetched samples.
+        Calling this method when prefetching is not enabled has no effect.
+        """
+        prefetcher = self._prefetcher
+        self._prefetcher = None
+        if prefetcher is not None:
+            prefetcher.stop()
 
-    def find_channels_by_pattern(self, pattern):
+    def disable_process_decoding(self):
+        """
+        Disable decoding of sample arrays in worker processes.
+
+        This stops the worker processes. Calling this method when process
+        decoding is not enabled has no effect.
+        """
+        process_decoder = self._process_decoder
+        self._process_decoder = None
+        if process_decoder is not None:
+            process_decoder.shutdown()
+
+    def disable_tile_cache(self):
+        """
+        Disable the tile cache for decimated queries.
+
+        This discards all cached tiles. Calling this method when the tile cache
+        is not enabled has no effect.
+        """
+        tile_cache = self._tile_cache
+        self._tile_cache = None
+        if tile_cache is not None:
+            tile_cache.shutdown()
+
+    def enable_prefetch(self, max_workers=2, cache_size=64):
+        """
+        Enable predictive prefetching of samples.
+
+        When prefetching is enabled, the client watches the sequence of calls
+        to ``get_samples`` for each channel. When it detects that the user is
+        panning (moving a window of the same size) or zooming (scaling the
+        window by a constant factor), it fetches the window that is likely to
+        be requested next in the background. Without such a pattern, it
+        fetches the windows adjacent to the last one. When the predicted
+        window is actually requested, it is served from memory.
+
+        Prefetch requests are only started while no call to ``get_samples`` is
+        in progress, so they do not delay the requests made by the user. The
+        prefetched results are shared with the caller, so they must not be
+        modified.
+
+        :param max_workers:
+            number of background threads that run prefetch requests. The
+            default is two.
+        :param cache_size:
+            maximum number of prefetched results that are kept in memory. When
+            this number is exceeded, the least recently used result is
+            discarded. The default is 64.
+        """
+        self.disable_prefetch()
+        self._prefetcher = _prefetch.Prefetcher(
+            self._query_samples,
+            max_workers=max_workers,
+            cache_size=cache_size,
+            timeout=self._timeout)
+
+    def enable_process_decoding(self, max_workers=None):
+        """
+        Enable decoding of sample arrays in worker processes.
+
+        When process decoding is enabled, ``get_sample_arrays`` and
+        ``get_sample_arrays_many`` receive the response (still compressed) in
+        the calling thread, but decompress and decode it in a pool of worker
+        processes. The workers pass the resulting arrays back through shared
+        memory. This way, decoding many large responses in parallel can use
+        all CPU cores instead of being limited by the global interpreter lock.
+
+        The worker processes are started with the ``spawn`` method, so the
+        main module of the program must be safe to import (i.e. protected by
+        ``if __name__ == '__main__'``).
+
+        :param max_workers:
+            number of worker processes. If ``None`` (the default), the number
+            of CPUs is used.
+        """
+        self.disable_process_decoding()
+        self._process_decoder = _process_decode.ProcessDecoder(
+            max_workers=max_workers)
+
+    def enable_tile_cache(self, tile_samples=256, max_tiles=4096):
+        """
+        Enable the tile cache for decimated queries.
+
+        When the tile cache is enabled, calls to ``get_samples`` with a
+        non-zero ``count`` are not sent to the server as they are. Instead, the
+        requested resolution (the length of the time range divided by the
+        count) is rounded down to a power of two nanoseconds, and the range is
+        covered with aligned time tiles of ``tile_samples`` samples at that
+        resolution. Whole tiles are fetched and cached, and the result is
+        assembled from the tiles. Because the tiles are aligned, queries for
+        similar ranges use the same tiles, so they are mostly served from
+        memory.
+
+        As a consequence, a result may contain up to twice as many samples as
+        requested, and the decimation level used by the server might differ
+        from the one that it would have selected for the original query. Raw
+        queries (``count`` of zero) are not affected. The cached samples are
+        shared between callers, so they must not be modified.
+
+        :param tile_samples:
+            number of samples that are requested for each tile. The default is
+            256.
+        :param max_tiles:
+            maximum number of tiles that are kept in memory. When this number
+            is exceeded, the least recently used tile is discarded. The default
+            is 4096.
+        """
+        self.disable_tile_cache()
+        self._tile_cache = _tile_cache.TileCache(
+            self._get_json,
+            self._samples_url,
+            tile_samples=tile_samples,
+            max_tiles=max_tiles)
+
+    def find_channels_by_pattern(self, pattern, timeout=None):
         """
         Find and return channel names matching the specified pattern.
 
@@ -51,21 +242,113 @@ class ArchiveClient(object):
         number of characters and "?" matches exactly one character.
 
         :param pattern: glob pattern to which channel names are matched.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including receiving and decoding the response. If ``None`` (the
+            default), the timeout specified when creating the client is used.
         :return: list of channel names matching the pattern.
         """
         req_url = '/archive/1/channels-by-pattern/{0}' \
             .format(urllib.parse.quote(pattern, safe=''))
-        req = self._req(req_url)
-        with self._do_req(req) as resp:
-            status_code = resp.code
-            if status_code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            elif not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            return self._get_resp_data(resp)
+        return self._get_json(req_url, self._deadline_for(timeout))
 
-    def find_channels_by_regexp(self, regular_expression):
+    def find_channels_by_patterns(self, patterns, timeout=None):
+        """
+        Find the channel names matching each of the specified patterns.
+
+        The patterns are glob patterns like the ones used by
+        ``find_channels_by_pattern``. Instead of sending one request for each
+        pattern, the patterns are combined into a single regular expression,
+        so that the server only has to go through the channel names once. If
+        the regular expression gets too long for a single request, it is split
+        across several requests. The names returned by the server are then
+        matched against each pattern by the client. A pattern that is too long
+        to be sent as a regular expression on its own is sent in a separate
+        request, like for ``find_channels_by_pattern``.
+
+        :param patterns: iterable of glob patterns to which channel names are
+            matched.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including all requests. If ``None`` (the default), the timeout
+            specified when creating the client is used.
+        :return: dict mapping each pattern to the list of channel names
+            matching the pattern.
+        """
+        deadline = self._deadline_for(timeout)
+        # Patterns without wildcards can be matched with a simple lookup. The
+        # other patterns are grouped by their literal prefix (the part before
+        # the first wildcard), so that each channel name is only matched
+        # against the few patterns whose prefix it starts with, instead of
+        # trying every regular expression for every name.
+        channel_names_by_pattern = {}
+        literal_patterns = set()
+        long_patterns = []
+        regexps = []
+        wildcard_patterns_by_prefix = {}
+        for pattern in patterns:
+            if pattern in channel_names_by_pattern:
+                continue
+            channel_names_by_pattern[pattern] = []
+            regexp = _glob_to_regexp(pattern)
+            # The length includes the encoded "|" that separates the regular
+            # expression from the previous one.
+            regexp_length = len(urllib.parse.quote(
+                '(?:{0})'.format(regexp), safe='')) + 3
+            if regexp_length > _MAX_REGEXP_URL_LENGTH:
+                long_patterns.append(pattern)
+                continue
+            regexps.append((regexp, regexp_length))
+            wildcard = re.search('[*?]', pattern)
+            if wildcard is None:
+                literal_patterns.add(pattern)
+                continue
+            # Like in Java, "." does not match line terminators, so we do not
+            # use re.DOTALL.
+            wildcard_patterns_by_prefix.setdefault(
+                pattern[:wildcard.start()], []).append(
+                    (pattern, re.compile(regexp)))
+        prefix_lengths = sorted(
+            set(len(prefix) for prefix in wildcard_patterns_by_prefix))
+        chunks = []
+        chunk_length = 0
+        for regexp, regexp_length in regexps:
+            regexp = '(?:{0})'.format(regexp)
+            if chunks and chunk_length + regexp_length \
+                    <= _MAX_REGEXP_URL_LENGTH:
+                chunks[-1].append(regexp)
+                chunk_length += regexp_length
+            else:
+                chunks.append([regexp])
+                chunk_length = regexp_length
+        channel_names = set()
+        for chunk in chunks:
+            req_url = '/archive/1/channels-by-regexp/{0}'.format(
+                urllib.parse.quote('|'.join(chunk), safe=''))
+            channel_names.update(self._get_json(req_url, deadline))
+        # The server returns each matching name only once (and the names
+        # returned for different chunks are merged in a set), so the lookup
+        # for literal patterns cannot miss any duplicates.
+        for channel_name in sorted(channel_names):
+            if channel_name in literal_patterns:
+                channel_names_by_pattern[channel_name].append(channel_name)
+            for prefix_length in prefix_lengths:
+                if prefix_length > len(channel_name):
+                    break
+                candidates = wildcard_patterns_by_prefix.get(
+                    channel_name[:prefix_length], ())
+                for pattern, compiled_pattern in candidates:
+                    if compiled_pattern.fullmatch(channel_name):
+                        channel_names_by_pattern[pattern].append(channel_name)
+        # The glob pattern itself is shorter than the equivalent regular
+        # expression (which needs escaping), so these patterns are matched by
+        # the server.
+        for pattern in long_patterns:
+            req_url = '/archive/1/channels-by-pattern/{0}'.format(
+                urllib.parse.quote(pattern, safe=''))
+            channel_names_by_pattern[pattern] = sorted(
+                self._get_json(req_url, deadline))
+        return channel_names_by_pattern
+
+    def find_channels_by_regexp(self, regular_expression, timeout=None):
         """
         Find and return channel names matching the specified regular
         expression.
@@ -74,21 +357,125 @@ class ArchiveClient(object):
         valid regular expression that is understood by Java.
 
         :param regular_expression: regular to which channel names are matched.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including receiving and decoding the response. If ``None`` (the
+            default), the timeout specified when creating the client is used.
         :return: list of channel names matching the regular expression.
         """
         req_url = '/archive/1/channels-by-regexp/{0}' \
-            .format(urllib.parse.quote(pattern, safe=''))
-        req = self._req(req_url)
-        with self._do_req(req) as resp:
-            status_code = resp.code
-            if status_code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            elif not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            return self._get_resp_data(resp)
+            .format(urllib.parse.quote(regular_expression, safe=''))
+        return self._get_json(req_url, self._deadline_for(timeout))
+
+    def get_sample_arrays(self, channel_name, start_time, end_time, count=0,
+                          timeout=None):
+        """
+        Return the samples for the specified channel and time range as arrays.
+
+        This method requests the same samples as ``get_samples``, but returns
+        them in a ``SampleArrays`` object, which stores the time stamps and
+        values in compact arrays instead of a dict for each sample. Without
+        process decoding, the samples are converted while the response is
+        received. Prefetching, the tile cache, request coalescing, and hedging
+        are not used for these requests.
+
+        :param channel_name: name of the channel for which data shall be
+            returned.
+        :param start_time: start time of the interval (in nanoseconds since
+            epoch).
+        :param end_time: end time of the interval (in nanoseconds since
+            epoch).
+        :param count: approximate number of samples that shall be returned.
+            If zero (the default), raw samples are returned.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including receiving and decoding the response. If ``None`` (the
+            default), the timeout specified when creating the client is used.
+        :return: ``SampleArrays`` with the samples.
+        """
+        return self._get_sample_arrays(
+            channel_name, start_time, end_time, count,
+            self._deadline_for(timeout))
+
+    def get_sample_arrays_many(self,
+                               channel_names,
+                               start_time,
+                               end_time,
+                               count=0,
+                               max_workers=8,
+                               timeout=None):
+        """
+        Return the samples for several channels as arrays.
+
+        This works like calling ``get_sample_arrays`` for each channel, but
+        runs up to ``max_workers`` requests at the same time. Combined with
+        process decoding (see ``enable_process_decoding``), this makes use of
+        all CPU cores for decoding the responses.
+
+        :param channel_names: names of the channels for which data shall be
+            returned.
+        :param start_time: start time of the interval (in nanoseconds since
+            epoch).
+        :param end_time: end time of the interval (in nanoseconds since
+            epoch).
+        :param count: approximate number of samples that shall be returned for
+            each channel. If zero (the default), raw samples are returned.
+        :param max_workers: maximum number of requests that are run in
+            parallel. The default is eight.
+        :param timeout: maximum time (in seconds) for retrieving the samples of
+            all channels. If ``None`` (the default), the timeout specified when
+            creating the client is used.
+        :return: dict mapping each channel name to its ``SampleArrays``.
+        """
+        channel_names = list(channel_names)
+        if not channel_names:
+            return {}
+        deadline = self._deadline_for(timeout)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(channel_names))) as executor:
+            return dict(zip(
+                channel_names,
+                executor.map(
+                    lambda channel_name: self._get_sample_arrays(
+                        channel_name, start_time, end_time, count, deadline),
+                    channel_names)))
+
+    def get_waveform_arrays(self, channel_name, start_time, end_time, count=0,
+                            timeout=None):
+        """
+        Return the samples for the specified waveform channel and time range
+        as arrays.
+
+        This method requests the same samples as ``get_samples``, but returns
+        them in a ``WaveformArrays`` object. The elements of all waveforms are
+        stored in a single array, together with the offsets of the waveforms.
+        If all waveforms have the same length, the elements can be treated as a
+        two-dimensional array (samples times elements). If the server
+        aggregated the elements of decimated samples, their minimums and
+        maximums are stored in the same layout.
+
+        The elements are appended to the arrays sample by sample while the
+        response is received (or in a worker process if process decoding is
+        enabled). Prefetching, the tile cache, request coalescing, and hedging
+        are not used for these requests.
+
+        :param channel_name: name of the channel for which data shall be
+            returned.
+        :param start_time: start time of the interval (in nanoseconds since
+            epoch).
+        :param end_time: end time of the interval (in nanoseconds since
+            epoch).
+        :param count: approximate number of samples that shall be returned.
+            If zero (the default), raw samples are returned.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including receiving and decoding the response. If ``None`` (the
+            default), the timeout specified when creating the client is used.
+        :return: ``WaveformArrays`` with the samples.
+        """
+        return self._get_sample_arrays(
+            channel_name, start_time, end_time, count,
+            self._deadline_for(timeout), waveforms=True)
 
-    def get_samples(self, channel_name, start_time, end_time, count=0):
+    def get_samples(self, channel_name, start_time, end_time, count=0,
+                    timeout=None):
         """
         Return the samples for the specified channel and time range.
 
@@ -113,34 +500,231 @@ class ArchiveClient(object):
         :param count: approximate number of samples that shall be returned.
             If non-zero, the decimation level that is used is selected based on
             this number. If zero (the default), raw samples are returned.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including receiving and decoding the response. If ``None`` (the
+            default), the timeout specified when creating the client is used.
         :return: array with samples as returned by the server.
         """
-        req_url = '/archive/1/samples/{0}?start={1}&end={2}'\
-            .format(urllib.parse.quote(channel_name, safe=''),
-                    start_time,
-                    end_time)
-        if count > 0:
-            req_url += '&count={0}'.format(count)
-        req = self._req(req_url)
-        with self._do_req(req) as resp:
-            status_code = resp.code
-            if status_code == HTTPStatus.SERVICE_UNAVAILABLE:
-                raise Exception('Service currently not available')
-            elif not self._is_success_code(resp.code):
-                raise Exception('Request failed with status code {0}'.format(
-                    resp.code))
-            return self._get_resp_data(resp)
+        deadline = self._deadline_for(timeout)
+        prefetcher = self._prefetcher
+        if prefetcher is not None:
+            return prefetcher.get(
+                channel_name, start_time, end_time, count, deadline)
+        return self._query_samples(
+            channel_name, start_time, end_time, count, deadline)
+
+    def scan_threshold(self,
+                       channel_names,
+                       start_time,
+                       end_time,
+                       threshold,
+                       above=True,
+                       count=1000,
+                       max_workers=8,
+                       timeout=None):
+        """
+        Find all intervals in which channels exceeded a threshold.
+
+        Instead of requesting the raw samples for the whole time range, this
+        method first requests decimated samples and uses the minimum and
+        maximum of each decimation period for ruling out the periods that
+        cannot contain an event. Only the periods in which the threshold is
+        crossed are requested again (in finer resolution and finally as raw
+        samples), so that the exact start and end of each event can be
+        determined.
+
+        :param channel_names: names of the channels that shall be scanned.
+        :param start_time: start time of the interval (in nanoseconds since
+            epoch).
+        :param end_time: end time of the interval (in nanoseconds since
+            epoch).
+        :param threshold: threshold that has to be exceeded.
+        :param above: look for values above the threshold? If ``False``,
+            values below the threshold are looked for instead. Default is
+            ``True``.
+        :param count: approximate number of decimated samples that are
+            requested in each step. The default is 1000.
+        :param max_workers: maximum number of requests that are run in
+            parallel. The default is eight.
+        :param timeout: maximum time (in seconds) for the whole scan. If
+            ``None`` (the default), the timeout specified when creating the
+            client is used.
+        :return: dict mapping each channel name to the list of
+            ``ThresholdEvent`` objects (ordered by time) for the channel.
+        """
+        if count <= 0:
+            raise Exception('The count must be positive.')
+        deadline = self._deadline_for(timeout)
+        channel_names = list(channel_names)
+        intervals_by_channel = {
+            channel_name: [] for channel_name in channel_names}
+        if start_time >= end_time:
+            return intervals_by_channel
+        # The scan is split into tasks, each of them examining one range of a
+        # channel. A task may produce new tasks for the parts of its range that
+        # need to be examined more closely. The tasks are coordinated from this
+        # thread, so that the workers never have to wait for each other.
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, max_workers)) as executor:
+            pending = set()
+
+            def submit(channel_name, range_start, range_end, step, width):
+                future = executor.submit(
+                    self._scan_threshold_range, channel_name, range_start,
+                    range_end, threshold, above, count, step, width, deadline)
+                future.channel_name = channel_name
+                pending.add(future)
+
+            for channel_name in channel_names:
+                submit(channel_name, start_time, end_time, 0, None)
+            try:
+                while pending:
+                    done, pending = concurrent.futures.wait(
+                        pending,
+                        timeout=_deadline.remaining(deadline),
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    if not done:
+                        raise TimeoutError('Deadline exceeded')
+                    for future in done:
+                        intervals, ranges = future.result()
+                        intervals_by_channel[future.channel_name].extend(
+                            intervals)
+                        for subrange in ranges:
+                            submit(future.channel_name, *subrange)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+        return {
+            channel_name: [
+                threshold_scan.ThresholdEvent(
+                    channel_name, interval_start, interval_end)
+                for interval_start, interval_end
+                in threshold_scan.merge_intervals(intervals)
+            ]
+            for channel_name, intervals in intervals_by_channel.items()
+        }
+
+    def summarize(self,
+                  channel_name,
+                  start_time,
+                  end_time,
+                  count=0,
+                  percentiles=sample_statistics.DEFAULT_PERCENTILES,
+                  timeout=None):
+        """
+        Calculate statistics of the samples for the specified channel and time
+        range.
+
+        The samples are requested like with ``get_samples``, but they are
+        decoded while the response is received and only the statistics are
+        kept in memory, so even very large time ranges can be summarized.
+        Prefetching, the tile cache, request coalescing, and hedging are not
+        used for these requests.
+
+        :param channel_name: name of the channel for which the statistics
+            shall be calculated.
+        :param start_time: start time of the interval (in nanoseconds since
+            epoch).
+        :param end_time: end time of the interval (in nanoseconds since
+            epoch).
+        :param count: approximate number of samples that shall be used. If
+            non-zero, decimated samples are used, which is much faster for long
+            time ranges, but only gives approximate results. If zero (the
+            default), raw samples are used.
+        :param percentiles: percentiles (between 0 and 100) that shall be
+            estimated. The default is the 50th, 90th, and 99th percentile.
+        :param timeout: maximum time (in seconds) for the whole operation,
+            including receiving and decoding the response. If ``None`` (the
+            default), the timeout specified when creating the client is used.
+        :return: ``SampleSummary`` with the statistics (see the
+            ``sample_statistics`` module for details).
+        """
+        samples = self._iter_samples(
+            channel_name, start_time, end_time, count,
+            self._deadline_for(timeout))
+        return sample_statistics.summarize_samples(
+            samples, start_time, end_time, channel_name, percentiles)
+
+    def summarize_many(self,
+                       channel_names,
+                       start_time,
+                       end_time,
+                       count=0,
+                       percentiles=sample_statistics.DEFAULT_PERCENTILES,
+                       max_workers=8,
+                       timeout=None):
+        """
+        Calculate statistics of the samples for several channels in parallel.
+
+        This works like calling ``summarize`` for each channel, but runs up
+        to ``max_workers`` requests at the same time.
+
+        :param channel_names: names of the channels for which the statistics
+            shall be calculated.
+        :param start_time: start time of the interval (in nanoseconds since
+            epoch).
+        :param end_time: end time of the interval (in nanoseconds since
+            epoch).
+        :param count: approximate number of samples that shall be used for
+            each channel (see ``summarize``).
+        :param percentiles: percentiles (between 0 and 100) that shall be
+            estimated.
+        :param max_workers: maximum number of requests that are run in
+            parallel. The default is eight.
+        :param timeout: maximum time (in seconds) for summarizing all channels.
+            If ``None`` (the default), the timeout specified when creating the
+            client is used.
+        :return: dict mapping each channel name to its ``SampleSummary``.
+        """
+        channel_names = list(channel_names)
+        if not channel_names:
+            return {}
+        deadline = self._deadline_for(timeout)
+
+        def summarize_channel(channel_name):
+            samples = self._iter_samples(
+                channel_name, start_time, end_time, count, deadline)
+            return sample_statistics.summarize_samples(
+                samples, start_time, end_time, channel_name, percentiles)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(channel_names))) as executor:
+            return dict(zip(
+                channel_names,
+                executor.map(summarize_channel, channel_names)))
+
+    def _deadline_for(self, timeout):
+        """
+        Return the deadline for an operation with the specified timeout (or the
+        default timeout if ``timeout`` is ``None``).
+        """
+        return _deadline.from_timeout(
+            timeout if timeout is not None else self._timeout)
 
     @staticmethod
-    def _do_req(req):
+    def _do_req(req, deadline=None, cancellation=None):
         """
         Send a request object and return the response. If an `HTTPError` is
         raised, it is caught and returned instead of the response object.
+
+        If a deadline is specified, reading the response fails with a
+        ``TimeoutError`` once the deadline has passed. If a cancellation is
+        specified, the request fails as soon as it is cancelled.
         """
-        try:
-            return urllib.request.urlopen(req)
-        except urllib.error.HTTPError as err:
-            return err
+        return _deadline.urlopen(req, deadline, cancellation)
+
+    def _fetch_json(self, req, deadline, cancellation=None):
+        """
+        Send a request object and return the decoded JSON response.
+        """
+        with self._do_req(req, deadline, cancellation) as resp:
+            status_code = resp.code
+            if status_code == HTTPStatus.SERVICE_UNAVAILABLE:
+                raise Exception('Service currently not available')
+            elif not self._is_success_code(resp.code):
+                raise Exception(
+                    'Request failed with status code {0}'.format(resp.code))
+            return self._get_resp_data(resp)
 
     @staticmethod
     def _get_content_type_and_charset(resp):
@@ -161,10 +745,72 @@ class ArchiveClient(object):
         charset = extra_args.get('charset', None)
         return content_type, charset
 
+    def _get_json(self, url, deadline=None):
+        """
+        Send a GET request for the specified URL and return the decoded JSON
+        response.
+
+        If request coalescing is enabled, concurrent calls for the same URL
+        share a single request and its result. If hedge servers have been
+        specified, the request is hedged.
+        """
+        def attempt(server_index, cancellation):
+            req = self._req(url, base_url=self._base_urls[server_index])
+            return self._fetch_json(req, deadline, cancellation)
+
+        def fetch():
+            if self._hedger is not None:
+                return self._hedger.run(attempt, deadline)
+            return self._fetch_json(self._req(url), deadline)
+        if self._single_flight is None:
+            return fetch()
+        return self._single_flight.do(url, fetch, deadline)
+
+    def _get_sample_arrays(self, channel_name, start_time, end_time, count,
+                           deadline, waveforms=False):
+        """
+        Retrieve samples and convert them to arrays, using the worker
+        processes if process decoding is enabled.
+        """
+        process_decoder = self._process_decoder
+        if process_decoder is None:
+            samples = self._iter_samples(
+                channel_name, start_time, end_time, count, deadline)
+            if waveforms:
+                return sample_arrays.waveforms_from_samples(samples)
+            return sample_arrays.from_samples(samples)
+        req = self._req(
+            self._samples_url(channel_name, start_time, end_time, count))
+        with self._do_req(req, deadline) as resp:
+            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
+                raise Exception('Service currently not available')
+            elif not self._is_success_code(resp.code):
+                raise Exception(
+                    'Request failed with status code {0}'.format(resp.code))
+            content_type, charset = self._get_content_type_and_charset(resp)
+            if content_type != 'application/json':
+                raise Exception(
+                    'Expected content-type application/json, but got '
+                    '{0}.'.format(content_type))
+            content_encoding = resp.headers.get('Content-Encoding', None)
+            body = resp.read()
+        return process_decoder.decode(
+            body, content_encoding, charset or 'utf_8', waveforms, deadline)
+
     def _get_resp_data(self, resp):
         """
         Read and return JSON data from a response.
 
+        Raises an exception if the response does not have the expected content
+        type (``application/json``).
+        """
+        return json.load(self._get_resp_text_stream(resp))
+
+    def _get_resp_text_stream(self, resp):
+        """
+        Return a text stream for reading the JSON data from a response.
+
+        The stream takes care of decompressing the response if necessary.
         Raises an exception if the response does not have the expected content
         type (``application/json``).
         """
@@ -182,7 +828,7 @@ class ArchiveClient(object):
             file_object = gzip.GzipFile(fileobj=resp)
         else:
             file_object = resp
-        return json.load(io.TextIOWrapper(file_object, encoding=charset))
+        return io.TextIOWrapper(file_object, encoding=charset)
 
     @staticmethod
     def _is_success_code(status_code):
@@ -192,21 +838,56 @@ class ArchiveClient(object):
         """
         return (status_code >= 200) and (status_code < 300)
 
+    def _iter_samples(self, channel_name, start_time, end_time, count,
+                      deadline=None):
+        """
+        Request the samples for the specified channel and time range and
+        iterate over them while the response is being received.
+        """
+        req = self._req(
+            self._samples_url(channel_name, start_time, end_time, count))
+        with self._do_req(req, deadline) as resp:
+            if resp.code == HTTPStatus.SERVICE_UNAVAILABLE:
+                raise Exception('Service currently not available')
+            elif not self._is_success_code(resp.code):
+                raise Exception(
+                    'Request failed with status code {0}'.format(resp.code))
+            yield from _json_stream.iter_array(
+                self._get_resp_text_stream(resp))
+
+    def _query_samples(self, channel_name, start_time, end_time, count,
+                       deadline=None):
+        """
+        Retrieve samples from the server (or the tile cache if it is enabled
+        and the query is for decimated samples).
+        """
+        tile_cache = self._tile_cache
+        if tile_cache is not None and count > 0:
+            return tile_cache.get(
+                channel_name, start_time, end_time, count, deadline)
+        return self._get_json(
+            self._samples_url(channel_name, start_time, end_time, count),
+            deadline)
+
     # noinspection PyDefaultArgument
     def _req(self,
              url,
              data=None,
              headers={},
              method='GET',
-             authenticate=False):
+             authenticate=False,
+             base_url=None):
         """
         Creates and returns a request object.
 
         This method takes care of converting the supplied data object to JSON,
         setting the appropriate request headers and including an authorization
         header (if requested).
+
+        The request is sent to the primary server unless a different base URL
+        is specified.
         """
-        req_url = self._base_url + url
+        req_url = (base_url or self._base_url) + url
         if data is not None:
             req_data = json.dumps(data).encode()
         else:
@@ -222,3 +903,69 @@ class ArchiveClient(object):
             req_headers['Content-Type'] = 'application/json;charset=UTF-8'
         return urllib.request.Request(
             req_url, req_data, req_headers, method=method)
+
+    @staticmethod
+    def _samples_url(channel_name, start_time, end_time, count):
+        """
+        Return the URL (relative to the base URL) for retrieving the samples
+        for the specified channel and time range.
+        """
+        req_url = '/archive/1/samples/{0}?start={1}&end={2}'\
+            .format(urllib.parse.quote(channel_name, safe=''),
+                    start_time,
+                    end_time)
+        if count > 0:
+            req_url += '&count={0}'.format(count)
+        return req_url
+
+    def _scan_threshold_range(self, channel_name, start_time, end_time,
+                              threshold, above, count, step, parent_width,
+                              deadline):
+        """
+        Examine a range of a channel for ``scan_threshold``.
+
+        If ``step`` is ``None``, the raw samples are requested. Otherwise,
+        decimated samples are requested and classified.
+
+        :return: tuple of the list of intervals that are known to be part of
+            an event and the list of ranges that need to be examined more
+            closely (see ``threshold_scan.classify_decimated_samples``).
+        """
+        if step is None:
+            samples = self._iter_samples(
+                channel_name, start_time, end_time, 0, deadline)
+            return threshold_scan.find_threshold_intervals(
+                samples, start_time, end_time, threshold, above), []
+        samples = self._query_samples(
+            channel_name, start_time, end_time, count, deadline)
+        return threshold_scan.classify_decimated_samples(
+            samples, start_time, end_time, threshold, above, step,
+            parent_width)
+
+
+def _glob_to_regexp(pattern):
+    """
+    Translate a glob pattern into a regular expression.
+
+    "*" is translated to ".*" and "?" is translated to ".". All other
+    characters only match themselves. Characters other than letters, digits,
+    and the underscore are escaped with a backslash, which works the same way
+    in Java and Python regular expressions (unlike escaping letters or using
+    ``\\Q`` and ``\\E``).
+
+    :param pattern:
+        glob pattern.
+    :return:
+        regular expression matching the same strings as the glob pattern.
+    """
+    parts = []
+    for char in pattern:
+        if char == '*':
+            parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        elif char.isascii() and not (char.isalnum() or char == '_'):
+            parts.append('\\' + char)
+        else:
+            parts.append(char)
+    return ''.join(parts)
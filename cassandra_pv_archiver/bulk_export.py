@@ -0,0 +1,434 @@
+"""
+Command-line tool for exporting archived samples in bulk.
+
+The tool resolves one or more glob patterns to channel names, splits the
+requested time range into windows, and fetches the samples for all channels
+and windows in parallel. Each window is written to its own file in JSON Lines
+format (one sample per line). Completed windows are recorded in a checkpoint
+manifest for each channel, so that an interrupted export can be resumed by
+running the same command again.
+
+Usage::
+
+    python -m cassandra_pv_archiver.bulk_export myserver.example.com \\
+        'my_prefix:*' --start 2019-09-01T00:00:00 --end 2019-10-01T00:00:00 \\
+        --output-dir export
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import os.path
+import sys
+import threading
+import time
+import urllib.parse
+
+from cassandra_pv_archiver.archive_client import ArchiveClient
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+_NANOSECONDS_PER_SECOND = 1000000000
+
+
+class ExportProgress(object):
+    """
+    Thread-safe counters for the progress of an export.
+
+    ``errors`` is a list with a ``(channel_name, start_time, end_time,
+    exception)`` tuple for each window that could not be exported.
+    """
+
+    def __init__(self, total_windows):
+        """
+        Create the counters for an export of the specified number of windows.
+        """
+        self._lock = threading.Lock()
+        self.bytes_written = 0
+        self.errors = []
+        self.failed_windows = 0
+        self.finished_windows = 0
+        self.samples_written = 0
+        self.skipped_windows = 0
+        self.start_time = time.monotonic()
+        self.total_windows = total_windows
+
+    def add_failed_window(self, channel_name, start_time, end_time, error):
+        """
+        Count a window that could not be exported and record the error.
+        """
+        with self._lock:
+            self.errors.append((channel_name, start_time, end_time, error))
+            self.failed_windows += 1
+
+    def add_finished_window(self, samples, bytes_written):
+        """
+        Count a window that has been exported and the data written for it.
+        """
+        with self._lock:
+            self.bytes_written += bytes_written
+            self.finished_windows += 1
+            self.samples_written += samples
+
+    def add_skipped_window(self):
+        """
+        Count a window that was skipped because it had been exported before.
+        """
+        with self._lock:
+            self.skipped_windows += 1
+
+    def format(self):
+        """
+        Return a one-line summary of the progress and the throughput.
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self.start_time, 1e-9)
+            done = (self.finished_windows + self.skipped_windows
+                    + self.failed_windows)
+            return (
+                '{0}/{1} windows ({2} resumed, {3} failed), {4} samples, '
+                '{5:.0f} samples/s, {6:.2f} MB/s written'.format(
+                    done, self.total_windows, self.skipped_windows,
+                    self.failed_windows, self.samples_written,
+                    self.samples_written / elapsed,
+                    self.bytes_written / elapsed / 1e6))
+
+
+class BulkExporter(object):
+    """
+    Exporter that writes the samples for a set of channels and time windows to
+    files in an output directory.
+
+    Each channel gets its own directory (named after the URI-encoded channel
+    name) that contains one file per window and a checkpoint manifest listing
+    the windows that have been exported completely.
+    """
+
+    def __init__(self,
+                 client,
+                 output_dir,
+                 max_workers=8,
+                 count=0):
+        """
+        Create a bulk exporter.
+
+        :param client:
+            ``ArchiveClient`` that is used for retrieving the samples.
+        :param output_dir:
+            path to the directory into which the files are written.
+        :param max_workers:
+            maximum number of requests that are run in parallel. The default is
+            eight.
+        :param count:
+            approximate number of samples per window. If non-zero, decimated
+            samples are exported. If zero (the default), raw samples are
+            exported.
+        """
+        self._client = client
+        self._count = count
+        self._manifest_lock = threading.Lock()
+        self._max_workers = max_workers
+        self._output_dir = output_dir
+
+    def export(self, channel_names, windows, progress_callback=None,
+               progress_interval=1.0):
+        """
+        Export the samples for all combinations of channels and windows.
+
+        Windows that are already listed in the manifest of a channel (and
+        whose file still exists) are skipped, so calling this method again
+        after an interruption resumes the export.
+
+        :param channel_names:
+            names of the channels that shall be exported.
+        :param windows:
+            list of ``(start_time, end_time)`` tuples (in nanoseconds since
+            epoch). A sample belongs to a window if its time is greater than or
+            equal to the start time and less than the end time. The end time of
+            the last window is inclusive.
+        :param progress_callback:
+            function that is called periodically (and once at the end) with the
+            ``ExportProgress`` as its only argument. If ``None`` (the default),
+            progress is not reported.
+        :param progress_interval:
+            time between two calls of the progress callback (in seconds).
+        :return:
+            ``ExportProgress`` with the final counters.
+        """
+        progress = ExportProgress(len(channel_names) * len(windows))
+        stop_event = threading.Event()
+        reporter = None
+        if progress_callback is not None:
+            def report():
+                while not stop_event.wait(progress_interval):
+                    progress_callback(progress)
+            reporter = threading.Thread(target=report, daemon=True)
+            reporter.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._max_workers) as executor:
+                futures = []
+                for channel_name in channel_names:
+                    completed = self._completed_windows(channel_name)
+                    for index, window in enumerate(windows):
+                        if tuple(window) in completed:
+                            progress.add_skipped_window()
+                            continue
+                        last = index == len(windows) - 1
+                        futures.append(executor.submit(
+                            self._export_window, channel_name, window, last,
+                            progress))
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        finally:
+            stop_event.set()
+            if reporter is not None:
+                reporter.join()
+                progress_callback(progress)
+        return progress
+
+    def _channel_dir(self, channel_name):
+        """
+        Return the directory for the files of a channel.
+        """
+        return os.path.join(
+            self._output_dir, urllib.parse.quote(channel_name, safe=''))
+
+    def _completed_windows(self, channel_name):
+        """
+        Return the set of windows that have already been exported for a
+        channel (according to its manifest).
+        """
+        manifest = self._read_manifest(channel_name)
+        channel_dir = self._channel_dir(channel_name)
+        return {
+            (entry['start'], entry['end'])
+            for entry in manifest['windows']
+            if os.path.exists(os.path.join(channel_dir, entry['file']))
+        }
+
+    def _export_window(self, channel_name, window, last, progress):
+        """
+        Fetch the samples of a single window and write them to a file.
+
+        Errors are recorded in the progress instead of being raised, so that
+        one failing window does not abort the whole export. The partially
+        written file of a failed window is removed.
+        """
+        start_time, end_time = window
+        temp_path = None
+        # noinspection PyBroadException
+        try:
+            samples = self._client.get_samples(
+                channel_name, start_time, end_time, count=self._count)
+            channel_dir = self._channel_dir(channel_name)
+            os.makedirs(channel_dir, exist_ok=True)
+            file_name = '{0}-{1}.jsonl'.format(start_time, end_time)
+            file_path = os.path.join(channel_dir, file_name)
+            temp_path = file_path + '.tmp'
+            sample_count = 0
+            bytes_written = 0
+            with open(temp_path, 'w', encoding='utf_8') as file:
+                for sample in samples:
+                    # The server includes one sample before the start and
+                    # after the end of the interval, which belong to the
+                    # adjacent windows.
+                    sample_time = sample.get('time', start_time)
+                    if sample_time < start_time or sample_time > end_time:
+                        continue
+                    if sample_time == end_time and not last:
+                        continue
+                    # json.dumps escapes all non-ASCII characters, so the
+                    # length of the line is its size in bytes.
+                    line = json.dumps(sample) + '\n'
+                    file.write(line)
+                    sample_count += 1
+                    bytes_written += len(line)
+            os.replace(temp_path, file_path)
+            self._record_window(
+                channel_name, start_time, end_time, file_name, sample_count)
+            progress.add_finished_window(sample_count, bytes_written)
+        except Exception as e:
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            progress.add_failed_window(channel_name, start_time, end_time, e)
+
+    def _read_manifest(self, channel_name):
+        """
+        Read the manifest of a channel or return an empty manifest if it does
+        not exist yet.
+        """
+        manifest_path = os.path.join(
+            self._channel_dir(channel_name), MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_path):
+            return {'channelName': channel_name, 'windows': []}
+        with open(manifest_path, 'r', encoding='utf_8') as file:
+            return json.load(file)
+
+    def _record_window(self, channel_name, start_time, end_time, file_name,
+                       sample_count):
+        """
+        Add a completed window to the manifest of a channel.
+
+        The manifest is replaced atomically, so that it stays consistent even
+        if the export is interrupted while writing it.
+        """
+        with self._manifest_lock:
+            manifest = self._read_manifest(channel_name)
+            manifest['windows'] = [
+                entry for entry in manifest['windows']
+                if (entry['start'], entry['end']) != (start_time, end_time)]
+            manifest['windows'].append({
+                'end': end_time,
+                'file': file_name,
+                'samples': sample_count,
+                'start': start_time
+            })
+            manifest['windows'].sort(key=lambda entry: entry['start'])
+            manifest_path = os.path.join(
+                self._channel_dir(channel_name), MANIFEST_FILE_NAME)
+            with open(manifest_path + '.tmp', 'w', encoding='utf_8') as file:
+                json.dump(manifest, file, indent=1)
+            os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def main(args=None):
+    """
+    Run the bulk export tool.
+
+    :param args:
+        command-line arguments (without the program name). If ``None`` (the
+        default), ``sys.argv`` is used.
+    :return:
+        exit code (zero if all windows were exported successfully).
+    """
+    parser = argparse.ArgumentParser(
+        prog='cassandra-pv-archiver-export',
+        description='Export archived samples for many channels into files, '
+                    'resuming an earlier export into the same directory.')
+    parser.add_argument(
+        'server_name',
+        help='hostname or IP address of the archive server')
+    parser.add_argument(
+        'patterns', nargs='+', metavar='pattern',
+        help='glob pattern for the names of the channels to be exported')
+    parser.add_argument(
+        '--port', type=int, default=9812,
+        help='port of the archive-access interface (default: 9812)')
+    parser.add_argument(
+        '--start', required=True, type=parse_time,
+        help='start of the time range (ISO 8601 date and time, UTC unless an '
+             'offset is specified, or nanoseconds since epoch)')
+    parser.add_argument(
+        '--end', required=True, type=parse_time,
+        help='end of the time range (same format as --start)')
+    parser.add_argument(
+        '--output-dir', required=True,
+        help='directory into which the samples are written')
+    parser.add_argument(
+        '--window', type=float, default=86400.0,
+        help='length of each window in seconds (default: 86400)')
+    parser.add_argument(
+        '--count', type=int, default=0,
+        help='approximate number of decimated samples per window (default: '
+             '0, meaning raw samples)')
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='number of parallel requests (default: 8)')
+    parser.add_argument(
+        '--quiet', action='store_true',
+        help='do not report progress')
+    parsed_args = parser.parse_args(args)
+    if parsed_args.end < parsed_args.start:
+        parser.error('The end of the time range is before its start.')
+    if parsed_args.window <= 0:
+        parser.error('The window length must be positive.')
+    client = ArchiveClient(parsed_args.server_name, parsed_args.port)
+    channel_names = set()
+    for pattern in parsed_args.patterns:
+        channel_names.update(client.find_channels_by_pattern(pattern))
+    channel_names = sorted(channel_names)
+    windows = split_time_range(
+        parsed_args.start,
+        parsed_args.end,
+        int(parsed_args.window * _NANOSECONDS_PER_SECOND))
+    os.makedirs(parsed_args.output_dir, exist_ok=True)
+    exporter = BulkExporter(
+        client,
+        parsed_args.output_dir,
+        max_workers=parsed_args.workers,
+        count=parsed_args.count)
+    progress_callback = None
+    if not parsed_args.quiet:
+        print('Exporting {0} channel(s) in {1} window(s).'.format(
+            len(channel_names), len(windows)), file=sys.stderr)
+
+        def progress_callback(progress):
+            print(progress.format(), file=sys.stderr)
+    progress = exporter.export(
+        channel_names, windows, progress_callback=progress_callback)
+    for channel_name, start_time, end_time, error in progress.errors:
+        print('Export of channel {0} for window {1}-{2} failed: {3}'.format(
+            channel_name, start_time, end_time, error), file=sys.stderr)
+    return 1 if progress.failed_windows else 0
+
+
+def parse_time(value):
+    """
+    Convert a time specified on the command line to nanoseconds since epoch.
+
+    :param value:
+        either an integer number of nanoseconds or an ISO 8601 date and time.
+        Times without an offset are interpreted as UTC.
+    :return:
+        number of nanoseconds since epoch.
+    """
+    if value.isdigit():
+        return int(value)
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Invalid time: {0}'.format(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    delta = parsed - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return ((delta.days * 86400 + delta.seconds) * _NANOSECONDS_PER_SECOND
+            + delta.microseconds * 1000)
+
+
+def split_time_range(start_time, end_time, window_length):
+    """
+    Split a time range into windows of a fixed length.
+
+    The windows are aligned to multiples of the window length, so that the
+    same windows are generated when the start or end of the range changes
+    slightly (which is important for resuming an export).
+
+    :param start_time:
+        start of the range (in nanoseconds since epoch).
+    :param end_time:
+        end of the range (in nanoseconds since epoch).
+    :param window_length:
+        length of each window (in nanoseconds).
+    :return:
+        list of ``(start_time, end_time)`` tuples. The first and the last
+        window are clipped to the range.
+    """
+    windows = []
+    window_start = start_time
+    while True:
+        window_end = min(
+            (window_start // window_length + 1) * window_length, end_time)
+        windows.append((window_start, window_end))
+        if window_end >= end_time:
+            return windows
+        window_start = window_end
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Column-oriented channel inventory for a whole Cassandra PV Archiver cluster.
+
+The ``list_channels_for_all_servers`` function lists the channels of all
+servers in a cluster concurrently and merges them into a single
+``ChannelTable``. Servers that cannot be queried do not abort the listing, but
+are reported in the table's ``server_errors``.
+"""
+
+import concurrent.futures
+
+SERVER_ID_COLUMN = 'serverId'
+
+_DEFAULT_MAX_WORKERS = 16
+
+
+class ChannelTable(object):
+    """
+    Table storing information about channels in a column-oriented way.
+
+    Each column is a list that contains one element for each channel. The
+    ``serverId`` column identifies the server from which each row was
+    retrieved. Fields that are missing for a specific channel are ``None``.
+
+    The ``server_errors`` attribute is a dict that maps the ID of each server
+    for which the channels could not be listed to the exception that was
+    raised. If it is not empty, the table is incomplete.
+    """
+
+    def __init__(self, columns=None, server_errors=None):
+        """
+        Create a channel table.
+
+        :param columns:
+            dict mapping column names to lists of values. All lists must have
+            the same length. If ``None`` (the default), an empty table is
+            created.
+        :param server_errors:
+            dict mapping server IDs to exceptions. If ``None`` (the default),
+            an empty dict is used.
+        """
+        self.columns = columns if columns is not None else {}
+        self.server_errors = (
+            server_errors if server_errors is not None else {})
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __getitem__(self, column_name):
+        return self.columns[column_name]
+
+    @property
+    def column_names(self):
+        """
+        List with the names of all columns.
+        """
+        return list(self.columns)
+
+    def is_complete(self):
+        """
+        Tell whether the channels of all servers could be listed.
+
+        :return:
+            ``True`` if there were no errors, ``False`` otherwise.
+        """
+        return not self.server_errors
+
+    def iter_rows(self):
+        """
+        Iterate over the rows of the table.
+
+        :return:
+            iterator over dicts, each of them mapping the column names to the
+            values for a single channel. Columns with a value of ``None`` are
+            omitted.
+        """
+        column_names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield {
+                name: value for name, value in zip(column_names, values)
+                if value is not None
+            }
+
+    def to_arrow(self):
+        """
+        Convert the table to an Arrow table.
+
+        This method needs the ``pyarrow`` package.
+
+        :return:
+            ``pyarrow.Table`` with the same columns as this table.
+        """
+        import pyarrow
+        return pyarrow.table(self.columns)
+
+    def to_numpy(self):
+        """
+        Convert the columns of the table to NumPy arrays.
+
+        Columns that only contain booleans or numbers (and no missing values)
+        are converted to arrays with the respective data type. All other
+        columns are converted to arrays of Python objects.
+
+        This method needs the ``numpy`` package.
+
+        :return:
+            dict mapping the column names to NumPy arrays.
+        """
+        import numpy
+        arrays = {}
+        for name, values in self.columns.items():
+            if values and all(
+                    isinstance(value, (bool, int, float))
+                    for value in values):
+                arrays[name] = numpy.array(values)
+            else:
+                array = numpy.empty(len(values), dtype=object)
+                array[:] = values
+                arrays[name] = array
+        return arrays
+
+    def _append_columns(self, columns, row_count):
+        """
+        Append the rows from a dict of columns (all having the specified number
+        of rows) to this table.
+
+        Columns that only exist on one side are padded with ``None``.
+        """
+        table_row_count = len(self)
+        for name, values in columns.items():
+            if name not in self.columns:
+                self.columns[name] = [None] * table_row_count
+            self.columns[name].extend(values)
+        for name, values in self.columns.items():
+            if name not in columns:
+                values.extend([None] * row_count)
+
+
+def list_channels_for_all_servers(client,
+                                  server_ids=None,
+                                  max_workers=_DEFAULT_MAX_WORKERS,
+                                  timeout=60.0):
+    """
+    List the channels of all servers concurrently and merge them into a table.
+
+    The channels for each server are retrieved with the same request that is
+    also used by the ``list_channels_for_server`` method of the
+    ``AdminClient``, so the rows contain status information for servers that
+    are online. The requests for the different servers run in parallel and
+    each response is decoded while it is received.
+
+    If the channels of a server cannot be listed (e.g. because the request
+    times out), this does not abort the whole listing. Instead, the error is
+    recorded in the ``server_errors`` of the returned table.
+
+    :param client:
+        ``AdminClient`` that is used for sending the requests.
+    :param server_ids:
+        IDs of the servers for which the channels shall be listed. If ``None``
+        (the default), all servers in the cluster status are used.
+    :param max_workers:
+        maximum number of requests that are run in parallel. The default is
+        16.
+    :param timeout:
+        maximum time (in seconds) for listing the channels of each server.
+        If ``None``, the default timeout of the client is used. The default is
+        60 seconds.
+    :return:
+        ``ChannelTable`` with a row for each channel. The rows of each server
+        are contiguous, and the servers are ordered like in ``server_ids``.
+    """
+    if server_ids is None:
+        server_ids = [
+            server['serverId']
+            for server in client.get_cluster_status().get('servers', [])
+        ]
+    server_ids = list(server_ids)
+    table = ChannelTable()
+    if not server_ids:
+        return table
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(server_ids))) as executor:
+        futures = [
+            executor.submit(_list_server_columns, client, server_id, timeout)
+            for server_id in server_ids
+        ]
+        # We merge the results in the order of the servers, so that the
+        # layout of the table does not depend on the timing of the requests.
+        for server_id, future in zip(server_ids, futures):
+            try:
+                columns, row_count = future.result()
+            except Exception as e:
+                table.server_errors[server_id] = e
+                continue
+            table._append_columns(columns, row_count)
+    if SERVER_ID_COLUMN not in table.columns:
+        table.columns[SERVER_ID_COLUMN] = []
+    return table
+
+
+def _list_server_columns(client, server_id, timeout):
+    """
+    List the channels of a single server and return them as columns.
+
+    :return:
+        tuple of a dict mapping column names to lists of values and the number
+        of rows.
+    """
+    columns = {SERVER_ID_COLUMN: []}
+    row_count = 0
+    for channel in client.iter_channels_for_server(
+            server_id, timeout=timeout):
+        for name, value in channel.items():
+            if name == SERVER_ID_COLUMN:
+                continue
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * row_count
+            column.append(value)
+        row_count += 1
+        for column in columns.values():
+            if len(column) < row_count:
+                column.append(None)
+    # The server ID column is filled at the end, because the server that owns a
+    # channel is the one that has been queried, regardless of whether the
+    # response contains this field.
+    columns[SERVER_ID_COLUMN] = [server_id] * row_count
+    return columns, row_count
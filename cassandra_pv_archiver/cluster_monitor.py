@@ -0,0 +1,397 @@
+"""
+Background monitoring of the status of a Cassandra PV Archiver cluster.
+
+A ``ClusterMonitor`` polls the cluster status and the server status through
+one or more ``AdminClient`` instances in a single background thread and
+notifies subscribers about changes. This way, many consumers can share one
+polling loop instead of each polling the server on their own.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class ClusterMonitorEvent(object):
+    """
+    Base class of all events generated by a ``ClusterMonitor``.
+
+    Each event has a ``server_id`` attribute identifying the server that is
+    affected by the event (``None`` if the event does not affect a specific
+    server) and a ``timestamp`` attribute that specifies when the change was
+    detected (in seconds since epoch).
+    """
+
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(name, value)
+            for name, value in sorted(vars(self).items())))
+
+
+class ServerAddedEvent(ClusterMonitorEvent):
+    """
+    Event generated when a server appears in the cluster status.
+
+    The ``server_status`` attribute contains the server's entry from the
+    cluster status.
+    """
+
+    def __init__(self, server_id, server_status):
+        super(ServerAddedEvent, self).__init__(server_id)
+        self.server_status = server_status
+
+
+class ServerRemovedEvent(ClusterMonitorEvent):
+    """
+    Event generated when a server disappears from the cluster status.
+    """
+
+
+class ServerWentOfflineEvent(ClusterMonitorEvent):
+    """
+    Event generated when the cluster status reports that a server that was
+    online before is offline now.
+    """
+
+
+class ServerWentOnlineEvent(ClusterMonitorEvent):
+    """
+    Event generated when the cluster status reports that a server that was
+    offline before is online now.
+    """
+
+
+class ChannelCountChangedEvent(ClusterMonitorEvent):
+    """
+    Event generated when one of the channel counters in a server's status
+    changes.
+
+    The ``counter_name`` attribute contains the name of the counter (e.g.
+    ``channelsTotal``), the ``old_count`` and ``new_count`` attributes contain
+    the previous and the current value.
+    """
+
+    def __init__(self, server_id, counter_name, old_count, new_count):
+        super(ChannelCountChangedEvent, self).__init__(server_id)
+        self.counter_name = counter_name
+        self.new_count = new_count
+        self.old_count = old_count
+
+
+class ServerStateChangedEvent(ClusterMonitorEvent):
+    """
+    Event generated when a field (other than a channel counter) in a server's
+    status changes.
+
+    The ``field_name`` attribute contains the name of the field, the
+    ``old_value`` and ``new_value`` attributes contain the previous and the
+    current value.
+    """
+
+    def __init__(self, server_id, field_name, old_value, new_value):
+        super(ServerStateChangedEvent, self).__init__(server_id)
+        self.field_name = field_name
+        self.new_value = new_value
+        self.old_value = old_value
+
+
+class PollFailedEvent(ClusterMonitorEvent):
+    """
+    Event generated when a status cannot be retrieved from a server.
+
+    The ``exception`` attribute contains the exception that was raised. If the
+    server status could not be retrieved, ``server_id`` is the ID of the server
+    that was polled (``None`` if the server status of the respective client
+    has never been retrieved successfully, so that its ID is not known yet).
+    After a failure, the next successful poll is treated like a change, so
+    that subscribers always get to see the current state again.
+    """
+
+    def __init__(self, server_id, exception):
+        super(PollFailedEvent, self).__init__(server_id)
+        self.exception = exception
+
+
+class ClusterMonitor(object):
+    """
+    Monitor that polls the status of a cluster in a background thread and
+    notifies subscribers about changes.
+
+    The cluster status is retrieved through the first of the specified
+    clients. The server status is retrieved through each of the clients (the
+    server status can only be queried for the server that a client is
+    connected to). Responses that are identical to the previous response (as
+    determined by a hash of the raw response body) are not decoded again.
+
+    Subscribers are called from the polling thread (or the thread calling
+    ``poll``), so they should return quickly. The monitor is safe for
+    concurrent use by different threads. Polls are serialized, so that the
+    events of concurrent polls are not generated from the same old state.
+    """
+
+    def __init__(self, clients, poll_interval=5.0):
+        """
+        Create a cluster monitor.
+
+        The monitor does not start polling before ``start`` is called. It can
+        also be used as a context manager, which starts it when entering the
+        context and stops it when leaving the context.
+
+        :param clients:
+            ``AdminClient`` or list of ``AdminClient`` instances through which
+            the status shall be retrieved.
+        :param poll_interval:
+            time between two polls (in seconds). The default is five seconds.
+        """
+        if not isinstance(clients, (list, tuple)):
+            clients = [clients]
+        if not clients:
+            raise Exception('At least one client must be specified.')
+        self._clients = list(clients)
+        self._cluster_status = None
+        self._lock = threading.Lock()
+        self._payload_hashes = {}
+        self._poll_interval = poll_interval
+        # Subscribers may call poll, so this lock must be reentrant.
+        self._poll_lock = threading.RLock()
+        self._server_ids = {}
+        self._server_statuses = {}
+        self._stop_event = threading.Event()
+        self._subscribers = []
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def cluster_status(self):
+        """
+        Most recently retrieved cluster status (``None`` if the cluster status
+        has not been retrieved yet).
+        """
+        with self._lock:
+            return self._cluster_status
+
+    @property
+    def server_statuses(self):
+        """
+        Dict mapping the ID of each polled server to its most recently
+        retrieved status.
+        """
+        with self._lock:
+            return dict(self._server_statuses)
+
+    def poll(self):
+        """
+        Poll the status once and notify subscribers about changes.
+
+        This method is called periodically by the background thread, but it
+        can also be called directly (e.g. when the monitor is not started).
+        """
+        with self._poll_lock:
+            self._poll_cluster_status()
+            for client in self._clients:
+                self._poll_server_status(client)
+
+    def start(self):
+        """
+        Start polling in a background thread.
+
+        The first poll happens immediately. Calling this method on a monitor
+        that has already been started has no effect.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='ClusterMonitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop polling and wait for the background thread to finish.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._stop_event.set()
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def subscribe(self, callback, event_types=None):
+        """
+        Register a function that is called for events.
+
+        :param callback:
+            function that is called with the event as its only argument.
+        :param event_types:
+            event class or tuple of event classes. The callback is only called
+            for events that are instances of one of these classes. If ``None``
+            (the default), the callback is called for all events.
+        """
+        with self._lock:
+            self._subscribers.append(
+                (callback, event_types or ClusterMonitorEvent))
+
+    def unsubscribe(self, callback):
+        """
+        Remove a function that has been registered with ``subscribe``.
+
+        :param callback:
+            function that shall not be called any longer.
+        """
+        with self._lock:
+            self._subscribers = [
+                subscriber for subscriber in self._subscribers
+                if subscriber[0] is not callback]
+
+    def _fetch_if_changed(self, fetch, key):
+        """
+        Retrieve JSON data with the specified function, which returns a tuple
+        of the raw body and its charset.
+
+        Returns ``None`` if the response body is identical to the one that was
+        received for the same key the last time.
+        """
+        body, charset = fetch()
+        payload_hash = hashlib.blake2b(body, digest_size=16).digest()
+        with self._lock:
+            if self._payload_hashes.get(key) == payload_hash:
+                return None
+        data = json.loads(body.decode(charset))
+        with self._lock:
+            self._payload_hashes[key] = payload_hash
+        return data
+
+    def _forget_payload(self, key):
+        """
+        Forget the hash of the last response for the specified key, so that
+        the next response is treated as a change.
+        """
+        with self._lock:
+            self._payload_hashes.pop(key, None)
+
+    def _notify(self, event):
+        """
+        Call all subscribers that are interested in the specified event.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, event_types in subscribers:
+            if not isinstance(event, event_types):
+                continue
+            # noinspection PyBroadException
+            try:
+                callback(event)
+            except Exception:
+                _logger.exception(
+                    'Subscriber of cluster monitor raised an exception.')
+
+    def _poll_cluster_status(self):
+        """
+        Retrieve the cluster status and generate the events for changes.
+        """
+        key = ('cluster-status',)
+        try:
+            new_status = self._fetch_if_changed(
+                self._clients[0].get_raw_cluster_status, key)
+        except Exception as e:
+            self._forget_payload(key)
+            self._notify(PollFailedEvent(None, e))
+            return
+        if new_status is None:
+            return
+        with self._lock:
+            old_status = self._cluster_status
+            self._cluster_status = new_status
+        if old_status is None:
+            # There is nothing to compare to on the first poll.
+            return
+        old_servers = _servers_by_id(old_status)
+        new_servers = _servers_by_id(new_status)
+        for server_id, server in new_servers.items():
+            old_server = old_servers.get(server_id)
+            if old_server is None:
+                self._notify(ServerAddedEvent(server_id, server))
+                continue
+            was_online = bool(old_server.get('online'))
+            is_online = bool(server.get('online'))
+            if was_online and not is_online:
+                self._notify(ServerWentOfflineEvent(server_id))
+            elif is_online and not was_online:
+                self._notify(ServerWentOnlineEvent(server_id))
+        for server_id in old_servers:
+            if server_id not in new_servers:
+                self._notify(ServerRemovedEvent(server_id))
+
+    def _poll_server_status(self, client):
+        """
+        Retrieve the server status through the specified client and generate
+        the events for changes.
+        """
+        key = ('server-status', id(client))
+        try:
+            new_status = self._fetch_if_changed(
+                client.get_raw_server_status, key)
+        except Exception as e:
+            self._forget_payload(key)
+            with self._lock:
+                server_id = self._server_ids.get(key)
+            self._notify(PollFailedEvent(server_id, e))
+            return
+        if new_status is None:
+            return
+        server_id = new_status.get('serverId')
+        with self._lock:
+            self._server_ids[key] = server_id
+            old_status = self._server_statuses.get(server_id)
+            self._server_statuses[server_id] = new_status
+        if old_status is None:
+            return
+        for field_name, new_value in sorted(new_status.items()):
+            old_value = old_status.get(field_name)
+            if new_value == old_value:
+                continue
+            if (field_name.startswith('channels')
+                    and isinstance(new_value, int)):
+                self._notify(ChannelCountChangedEvent(
+                    server_id, field_name, old_value, new_value))
+            else:
+                self._notify(ServerStateChangedEvent(
+                    server_id, field_name, old_value, new_value))
+
+    def _run(self):
+        """
+        Poll the status periodically until the monitor is stopped.
+        """
+        while not self._stop_event.is_set():
+            start_time = time.monotonic()
+            self.poll()
+            self._stop_event.wait(
+                max(0.0, self._poll_interval
+                    - (time.monotonic() - start_time)))
+
+
+def _servers_by_id(cluster_status):
+    """
+    Return a dict mapping server IDs to the servers' entries in the cluster
+    status.
+    """
+    return {
+        server['serverId']: server
+        for server in cluster_status.get('servers', [])
+    }
@@ -0,0 +1,432 @@
+"""
+Computation of the differences between two server configurations of the
+Cassandra PV Archiver.
+
+The functions in this module compare the configuration that is currently used
+by a server with a target configuration file and compute the minimal list of
+archive configuration commands that is needed in order to turn the current
+configuration into the target configuration. In contrast to importing the
+configuration file, this only sends the commands for those channels that are
+actually affected by a change.
+"""
+
+import io
+import re
+import tempfile
+import xml.etree.ElementTree
+
+from cassandra_pv_archiver.admin_client import ArchiveConfigurationCommands
+
+_CHANNEL_TAG = 'channel'
+_CONTROL_SYSTEM_OPTION_TAG = 'control-system-option'
+_DECIMATION_LEVEL_TAG = 'decimation-level'
+
+_SPOOLED_FILE_MAX_SIZE = 16 * 1024 * 1024
+
+_ISO_DURATION_PATTERN = re.compile(
+    r'^P(?:(\d+)W)?(?:(\d+)D)?'
+    r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?$')
+
+
+class ChannelConfiguration(object):
+    """
+    Configuration of a single channel as specified in a configuration file.
+    """
+
+    __slots__ = ('channel_name', 'control_system_type',
+                 'decimation_level_to_retention_period', 'enabled', 'options')
+
+    def __init__(self,
+                 channel_name,
+                 control_system_type,
+                 decimation_level_to_retention_period,
+                 enabled,
+                 options):
+        """
+        Create a channel configuration.
+
+        :param channel_name:
+            name of the channel.
+        :param control_system_type:
+            internal identifier for the control-system support that is used
+            for the channel.
+        :param decimation_level_to_retention_period:
+            dict mapping the decimation period of each decimation level to its
+            retention period (both specified in seconds). The raw decimation
+            level (with a decimation period of zero) is always present.
+        :param enabled:
+            ``True`` if archiving is enabled for the channel, ``False``
+            otherwise.
+        :param options:
+            dict with the control-system-specific configuration options.
+        """
+        self.channel_name = channel_name
+        self.control_system_type = control_system_type
+        self.decimation_level_to_retention_period = \
+            decimation_level_to_retention_period
+        self.enabled = enabled
+        self.options = options
+
+    def __eq__(self, other):
+        if not isinstance(other, ChannelConfiguration):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__)
+
+    def __repr__(self):
+        return 'ChannelConfiguration({0})'.format(', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+class ConfigurationDiff(object):
+    """
+    Differences between the current and the target configuration of a server.
+
+    The ``commands`` attribute contains the list of archive configuration
+    commands that turn the current configuration into the target
+    configuration. It can be passed to the
+    ``run_archive_configuration_commands`` method of an ``AdminClient``.
+
+    The ``added_channels``, ``removed_channels``, and ``updated_channels``
+    attributes contain the (sorted) names of the channels that are affected by
+    these commands. Channels that are present in both configurations, but use
+    a different control-system type cannot be updated in place. They are listed
+    in ``conflicting_channels`` and no commands are generated for them.
+    Channels that would have been added, removed, or updated, but were excluded
+    because the respective operation was not enabled are listed in
+    ``skipped_channels``.
+    """
+
+    def __init__(self, server_id):
+        """
+        Create an empty configuration diff.
+
+        :param server_id:
+            UUID of the server to which the configurations belong.
+        """
+        self.server_id = server_id
+        self.added_channels = []
+        self.commands = ArchiveConfigurationCommands()
+        self.conflicting_channels = []
+        self.removed_channels = []
+        self.skipped_channels = []
+        self.unchanged_channel_count = 0
+        self.updated_channels = []
+
+    def is_empty(self):
+        """
+        Tell whether this diff contains any commands.
+
+        :return:
+            ``True`` if applying this diff would not change anything, ``False``
+            otherwise.
+        """
+        return len(self.commands) == 0
+
+    def report(self):
+        """
+        Return a human-readable report describing the changes.
+
+        This can be used as a dry run, showing which changes would be made
+        when running the commands of this diff.
+
+        :return:
+            multi-line string describing the changes.
+        """
+        lines = [
+            'Configuration changes for server {0}:'.format(self.server_id),
+            '  {0} channel(s) to add, {1} to remove, {2} to update, '
+            '{3} unchanged.'.format(
+                len(self.added_channels), len(self.removed_channels),
+                len(self.updated_channels), self.unchanged_channel_count)]
+        for title, channel_names in (
+                ('Add', self.added_channels),
+                ('Remove', self.removed_channels),
+                ('Update', self.updated_channels),
+                ('Conflict (control-system type changed)',
+                 self.conflicting_channels),
+                ('Skipped (operation not enabled)', self.skipped_channels)):
+            for channel_name in channel_names:
+                lines.append('  {0}: {1}'.format(title, channel_name))
+        return '\n'.join(lines)
+
+    def _sort(self):
+        """
+        Sort the lists of channel names.
+        """
+        self.added_channels.sort()
+        self.conflicting_channels.sort()
+        self.removed_channels.sort()
+        self.skipped_channels.sort()
+        self.updated_channels.sort()
+
+
+def diff_configuration_files(server_id,
+                             current_configuration_file,
+                             target_configuration_file,
+                             add_channels=True,
+                             remove_channels=False,
+                             update_channels=True):
+    """
+    Compute the differences between two configuration files.
+
+    The current configuration is parsed into a compact summary that only
+    contains the information relevant for the comparison. The target
+    configuration is then parsed incrementally and compared channel by channel,
+    so that it never has to be held in memory completely.
+
+    The summary of the current configuration is kept in memory for the whole
+    comparison, so the memory consumption grows linearly with the number of
+    channels in the current configuration (not with the size of the target
+    file). The names of the affected channels and the generated commands are
+    kept in memory as well.
+
+    The meaning of the ``add_channels``, ``remove_channels``, and
+    ``update_channels`` flags is the same as for the
+    ``import_server_configuration`` method of the ``AdminClient``.
+
+    :param server_id:
+        UUID of the server to which the configurations belong. This ID is used
+        for new channels and as the expected server ID for all other commands.
+    :param current_configuration_file:
+        path to or file object for the current configuration. If this is a
+        binary (bytes) object instead of a string, it is interpreted as the
+        file contents and used directly instead.
+    :param target_configuration_file:
+        path to or file object for the target configuration. If this is a
+        binary (bytes) object instead of a string, it is interpreted as the
+        file contents and used directly instead.
+    :param add_channels:
+        generate commands for channels that only exist in the target
+        configuration? Default is ``True``.
+    :param remove_channels:
+        generate commands for channels that only exist in the current
+        configuration? Default is ``False``.
+    :param update_channels:
+        generate commands for channels that exist in both configurations, but
+        differ? Default is ``True``.
+    :return:
+        ``ConfigurationDiff`` describing the differences.
+    """
+    current_channels = {
+        channel.channel_name: channel
+        for channel in iter_configuration_file(current_configuration_file)
+    }
+    diff = ConfigurationDiff(server_id)
+    commands = diff.commands
+    for target in iter_configuration_file(target_configuration_file):
+        current = current_channels.pop(target.channel_name, None)
+        if current is None:
+            if add_channels:
+                diff.added_channels.append(target.channel_name)
+                levels = target.decimation_level_to_retention_period
+                commands.add_channel(
+                    target.channel_name,
+                    target.control_system_type,
+                    server_id,
+                    decimation_levels=levels.keys(),
+                    decimation_level_to_retention_period=levels,
+                    enabled=target.enabled,
+                    options=target.options)
+            else:
+                diff.skipped_channels.append(target.channel_name)
+        elif current == target:
+            diff.unchanged_channel_count += 1
+        elif current.control_system_type != target.control_system_type:
+            diff.conflicting_channels.append(target.channel_name)
+        elif update_channels:
+            diff.updated_channels.append(target.channel_name)
+            _append_update_command(commands, server_id, current, target)
+        else:
+            diff.skipped_channels.append(target.channel_name)
+    for channel_name in current_channels:
+        if remove_channels:
+            diff.removed_channels.append(channel_name)
+            commands.remove_channel(
+                channel_name, expected_server_id=server_id)
+        else:
+            diff.skipped_channels.append(channel_name)
+    diff._sort()
+    return diff
+
+
+def diff_server_configuration(client,
+                              server_id,
+                              configuration_file,
+                              add_channels=True,
+                              remove_channels=False,
+                              update_channels=True):
+    """
+    Compute the differences between a server's configuration and a file.
+
+    The current configuration is retrieved through the
+    ``export_server_configuration`` method of the specified client and
+    spooled to a temporary file if it is large. The
+    returned diff can be inspected (e.g. using its ``report`` method) and
+    applied by passing its ``commands`` to the
+    ``run_archive_configuration_commands`` method of the client.
+
+    :param client:
+        ``AdminClient`` that is used for retrieving the current configuration.
+    :param server_id:
+        UUID of the server for which the configuration shall be compared.
+    :param configuration_file:
+        path to the target configuration file. If this is a binary (bytes)
+        object instead of a string, it is interpreted as the file contents and
+        used directly instead.
+    :param add_channels:
+        generate commands for channels that only exist in the configuration
+        file? Default is ``True``.
+    :param remove_channels:
+        generate commands for channels that only exist on the server? Default
+        is ``False``.
+    :param update_channels:
+        generate commands for channels that exist both on the server and in the
+        configuration file, but differ? Default is ``True``.
+    :return:
+        ``ConfigurationDiff`` describing the differences.
+    """
+    # The exported configuration is kept in memory while it is small and moved
+    # to a temporary file when it gets large.
+    with tempfile.SpooledTemporaryFile(
+            max_size=_SPOOLED_FILE_MAX_SIZE) as current_configuration:
+        client.export_server_configuration(server_id, current_configuration)
+        current_configuration.seek(0)
+        return diff_configuration_files(
+            server_id,
+            current_configuration,
+            configuration_file,
+            add_channels=add_channels,
+            remove_channels=remove_channels,
+            update_channels=update_channels)
+
+
+def iter_configuration_file(configuration_file):
+    """
+    Parse a configuration file incrementally and yield its channels.
+
+    Elements are discarded as soon as the respective channel has been
+    processed, so the memory consumption does not depend on the size of the
+    file.
+
+    :param configuration_file:
+        path to or file object for the configuration file. If this is a binary
+        (bytes) object instead of a string, it is interpreted as the file
+        contents and used directly instead.
+    :return:
+        iterator over ``ChannelConfiguration`` objects, one for each channel in
+        the file.
+    """
+    if isinstance(configuration_file, bytes):
+        configuration_file = io.BytesIO(configuration_file)
+    parser = xml.etree.ElementTree.iterparse(
+        configuration_file, events=('start', 'end'))
+    root = None
+    for event, elem in parser:
+        if root is None:
+            root = elem
+        if event != 'end' or _local_name(elem.tag) != _CHANNEL_TAG:
+            continue
+        yield _parse_channel_element(elem)
+        # We remove the processed channel from the root element, so that the
+        # tree does not grow while parsing the file.
+        elem.clear()
+        root.clear()
+
+
+def parse_duration(duration):
+    """
+    Convert a duration from a configuration file to a number of seconds.
+
+    Durations are usually specified in the ISO 8601 format (e.g. ``PT30S`` or
+    ``P7D``), but a plain number of seconds is accepted as well. Years and
+    months are not supported because their length is not fixed.
+
+    :param duration:
+        duration string.
+    :return:
+        duration in seconds (as an ``int``).
+    """
+    duration = duration.strip()
+    if duration.isdigit():
+        return int(duration)
+    match = _ISO_DURATION_PATTERN.match(duration)
+    if match is None or duration in ('P', 'PT'):
+        raise Exception('Invalid duration: {0}'.format(duration))
+    weeks, days, hours, minutes, seconds = match.groups()
+    return int(
+        int(weeks or 0) * 604800
+        + int(days or 0) * 86400
+        + int(hours or 0) * 3600
+        + int(minutes or 0) * 60
+        + float(seconds or 0))
+
+
+def _append_update_command(commands, server_id, current, target):
+    """
+    Append the update command that turns ``current`` into ``target``.
+    """
+    current_levels = current.decimation_level_to_retention_period
+    target_levels = target.decimation_level_to_retention_period
+    add_decimation_levels = [
+        level for level in target_levels if level not in current_levels]
+    remove_decimation_levels = [
+        level for level in current_levels if level not in target_levels]
+    # The retention periods only have to be specified for the decimation
+    # levels that are added or have a changed retention period. The retention
+    # periods of all other decimation levels are left unchanged by the server.
+    retention_periods = {
+        level: period for level, period in target_levels.items()
+        if current_levels.get(level) != period}
+    add_options = {
+        name: value for name, value in target.options.items()
+        if current.options.get(name) != value}
+    remove_options = [
+        name for name in current.options if name not in target.options]
+    commands.update_channel(
+        target.channel_name,
+        add_decimation_levels=add_decimation_levels or None,
+        add_options=add_options or None,
+        decimation_level_to_retention_period=retention_periods or None,
+        enabled=(target.enabled
+                 if target.enabled != current.enabled else None),
+        expected_control_system_type=current.control_system_type,
+        expected_server_id=server_id,
+        remove_decimation_levels=remove_decimation_levels or None,
+        remove_options=remove_options or None)
+
+
+def _local_name(tag):
+    """
+    Return the tag name without the namespace.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_channel_element(elem):
+    """
+    Convert a ``channel`` element to a ``ChannelConfiguration``.
+    """
+    channel_name = elem.get('name')
+    if channel_name is None:
+        raise Exception('Found channel element without a name.')
+    enabled = elem.get('enabled', 'true').strip().lower() != 'false'
+    levels = {0: 0}
+    options = {}
+    for child in elem:
+        tag = _local_name(child.tag)
+        if tag == _DECIMATION_LEVEL_TAG:
+            retention_period = child.get('retention-period')
+            levels[parse_duration(child.get('period', '0'))] = (
+                parse_duration(retention_period)
+                if retention_period is not None else 0)
+        elif tag == _CONTROL_SYSTEM_OPTION_TAG:
+            options[child.get('name')] = child.get('value', '')
+    return ChannelConfiguration(
+        channel_name,
+        elem.get('control-system-type'),
+        levels,
+        enabled,
+        options)
@@ -0,0 +1,362 @@
+"""
+Planning and running the rebalancing of channels across archive servers.
+
+``plan_rebalance`` reads the channels of each server and computes a plan for
+distributing the load evenly. The load of a server is the sum of the weights
+of its channels (by default, each channel has a weight of one). The plan is
+computed with a bin-packing heuristic that only moves channels away from
+servers that are overloaded, so the number of moves stays small. The moves of
+a plan can then be run with ``execute_rebalance``, which sends them to the
+server in throttled batches.
+"""
+
+import heapq
+import threading
+import time
+
+from cassandra_pv_archiver.admin_client import ArchiveConfigurationCommands
+from cassandra_pv_archiver.channel_table import list_channels_for_all_servers
+
+
+class ChannelMove(object):
+    """
+    Move of a single channel from one server to another.
+    """
+
+    __slots__ = ('channel_name', 'old_server_id', 'new_server_id', 'weight')
+
+    def __init__(self, channel_name, old_server_id, new_server_id, weight):
+        """
+        Create a channel move.
+
+        :param channel_name: name of the channel.
+        :param old_server_id: ID of the server that currently owns the channel.
+        :param new_server_id: ID of the server to which the channel is moved.
+        :param weight: weight of the channel.
+        """
+        self.channel_name = channel_name
+        self.old_server_id = old_server_id
+        self.new_server_id = new_server_id
+        self.weight = weight
+
+    def __repr__(self):
+        return 'ChannelMove({0})'.format(', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+class RebalancePlan(object):
+    """
+    Plan for rebalancing channels across servers.
+
+    The ``moves`` attribute is the list of ``ChannelMove`` objects, ordered
+    so that the heaviest channels are moved first. The ``loads_before`` and
+    ``loads_after`` attributes are dicts that map each server ID to the load
+    of the server before and after running the moves.
+    """
+
+    def __init__(self, moves, loads_before, loads_after):
+        """
+        Create a plan.
+
+        :param moves: list of ``ChannelMove`` objects.
+        :param loads_before: dict mapping server IDs to the current loads.
+        :param loads_after: dict mapping server IDs to the loads after the
+            moves.
+        """
+        self.moves = moves
+        self.loads_before = loads_before
+        self.loads_after = loads_after
+
+    def commands(self):
+        """
+        Return the commands for running the moves of this plan.
+
+        Each move command specifies the server that currently owns the
+        channel as the expected old server, so a channel that has been moved
+        by someone else in the meantime is not moved again.
+
+        :return: ``ArchiveConfigurationCommands`` with a move command for each
+            move.
+        """
+        commands = ArchiveConfigurationCommands()
+        for move in self.moves:
+            commands.move_channel(
+                move.channel_name,
+                move.new_server_id,
+                expected_old_server_id=move.old_server_id)
+        return commands
+
+    def is_empty(self):
+        """
+        Tell whether this plan does not contain any moves.
+
+        :return:
+            ``True`` if there are no moves, ``False`` otherwise.
+        """
+        return not self.moves
+
+    def report(self):
+        """
+        Return a human-readable report describing the plan.
+
+        This can be used as a dry run, showing which channels would be moved.
+
+        :return:
+            multi-line string describing the plan.
+        """
+        lines = ['Rebalancing plan: {0} channel(s) to move.'.format(
+            len(self.moves))]
+        for server_id in sorted(self.loads_before):
+            lines.append('  Server {0}: load {1:g} -> {2:g}'.format(
+                server_id,
+                self.loads_before[server_id],
+                self.loads_after.get(server_id, 0)))
+        for move in self.moves:
+            lines.append('  Move: {0} ({1} -> {2})'.format(
+                move.channel_name, move.old_server_id, move.new_server_id))
+        return '\n'.join(lines)
+
+
+class RebalanceProgress(object):
+    """
+    Progress of running a rebalancing plan.
+
+    ``failed_moves`` is a list of tuples, each of them containing a
+    ``ChannelMove`` that failed and the error message (which might be
+    ``None``).
+    """
+
+    def __init__(self, total_moves):
+        """
+        Create the counters for running the specified number of moves.
+        """
+        self.failed_moves = []
+        self.finished_moves = 0
+        self.start_time = time.monotonic()
+        self.total_moves = total_moves
+
+    def format(self):
+        """
+        Return a one-line summary of the progress.
+        """
+        return '{0}/{1} move(s) done, {2} failed, {3:.0f} s elapsed'.format(
+            self.finished_moves,
+            self.total_moves,
+            len(self.failed_moves),
+            time.monotonic() - self.start_time)
+
+
+def compute_rebalance(channels_by_server,
+                      server_ids=None,
+                      tolerance=0.05,
+                      drain_server_ids=()):
+    """
+    Compute a plan for distributing channels evenly across servers.
+
+    The target load of each server is the total load divided by the number of
+    servers. Channels are only taken away from servers whose load exceeds the
+    target by more than the tolerance, and only until their load is within the
+    tolerance again, so these servers keep a load of up to the target plus the
+    tolerance. From these servers, the heaviest channels whose move brings the
+    load closer to the target are moved first. Such a move may leave the
+    server below the target, but never further away from it than before. The
+    channels that are taken away are then assigned to the servers with the
+    lowest load, heaviest channels first. This way, the plan needs few moves,
+    while the resulting loads are close to the target.
+
+    :param channels_by_server:
+        dict mapping each server ID to a dict that maps the names of the
+        channels owned by the server to their weights.
+    :param server_ids:
+        IDs of the servers across which the load shall be distributed. If
+        ``None`` (the default), all servers in ``channels_by_server`` except
+        the ones in ``drain_server_ids`` are used. Servers that are not in
+        ``channels_by_server`` do not own any channels yet.
+    :param tolerance:
+        fraction by which the load of a server may exceed the target load
+        before channels are moved away from it. The default is 0.05.
+    :param drain_server_ids:
+        IDs of servers from which all channels shall be moved to the servers
+        in ``server_ids``.
+    :return:
+        ``RebalancePlan`` with the moves.
+    """
+    drain_server_ids = set(drain_server_ids)
+    if server_ids is None:
+        server_ids = [
+            server_id for server_id in channels_by_server
+            if server_id not in drain_server_ids]
+    server_ids = [
+        server_id for server_id in server_ids
+        if server_id not in drain_server_ids]
+    if not server_ids:
+        raise Exception('There are no servers to which channels can be moved.')
+    loads_before = {server_id: 0 for server_id in server_ids}
+    loads_before.update(
+        (server_id, sum(channels.values()))
+        for server_id, channels in channels_by_server.items())
+    loads = {
+        server_id: loads_before.get(server_id, 0) for server_id in server_ids
+    }
+    target_load = (
+        sum(loads.values())
+        + sum(loads_before.get(server_id, 0)
+              for server_id in drain_server_ids)) / len(server_ids)
+    upper_load = target_load * (1.0 + tolerance)
+    # Each element of the pool is a tuple of the weight, the channel name, and
+    # the ID of the server that currently owns the channel.
+    pool = []
+    for server_id in drain_server_ids:
+        for channel_name, weight in channels_by_server.get(
+                server_id, {}).items():
+            pool.append((weight, channel_name, server_id))
+    for server_id in server_ids:
+        if loads[server_id] <= upper_load:
+            continue
+        candidates = sorted(
+            channels_by_server.get(server_id, {}).items(),
+            key=lambda item: (-item[1], item[0]))
+        for channel_name, weight in candidates:
+            if loads[server_id] <= upper_load:
+                break
+            excess = loads[server_id] - target_load
+            # A channel is only moved if this brings the load closer to the
+            # target, so that we do not move channels back and forth.
+            if 0 < weight < 2 * excess:
+                pool.append((weight, channel_name, server_id))
+                loads[server_id] -= weight
+    # The heaviest channels are assigned first, each to the server with the
+    # lowest load (longest processing time first).
+    pool.sort(key=lambda item: (-item[0], item[1]))
+    heap = [(load, server_id) for server_id, load in loads.items()]
+    heapq.heapify(heap)
+    moves = []
+    for weight, channel_name, old_server_id in pool:
+        load, server_id = heapq.heappop(heap)
+        heapq.heappush(heap, (load + weight, server_id))
+        loads[server_id] = load + weight
+        if server_id != old_server_id:
+            moves.append(ChannelMove(
+                channel_name, old_server_id, server_id, weight))
+    loads_after = dict(loads)
+    for server_id in drain_server_ids:
+        loads_after[server_id] = 0
+    return RebalancePlan(moves, loads_before, loads_after)
+
+
+def execute_rebalance(client,
+                      plan,
+                      batch_size=50,
+                      pause=1.0,
+                      progress_callback=None,
+                      stop_event=None):
+    """
+    Run the moves of a rebalancing plan in throttled batches.
+
+    The moves are sent to the server in batches of ``batch_size`` commands,
+    waiting for ``pause`` seconds between two batches, so that the servers are
+    not overwhelmed by a large number of simultaneous moves. A move that fails
+    does not stop the remaining moves. Instead, it is recorded in the
+    ``failed_moves`` of the returned progress. Each move specifies the server
+    that owned the channel when the plan was computed as the expected old
+    server, so channels that have been moved in the meantime are not moved
+    again (and reported as failed).
+
+    :param client:
+        ``AdminClient`` that is used for sending the commands.
+    :param plan:
+        ``RebalancePlan`` that shall be run.
+    :param batch_size:
+        number of moves that are sent in a single request. The default is 50.
+    :param pause:
+        time (in seconds) to wait between two batches. The default is one
+        second.
+    :param progress_callback:
+        function that is called with the ``RebalanceProgress`` after each
+        batch. If ``None`` (the default), progress is not reported.
+    :param stop_event:
+        ``threading.Event`` that can be set for stopping after the current
+        batch. If ``None`` (the default), all batches are run.
+    :return:
+        ``RebalanceProgress`` after running the moves.
+    """
+    if batch_size <= 0:
+        raise Exception('The batch size must be positive.')
+    if stop_event is None:
+        stop_event = threading.Event()
+    commands = plan.commands()
+    progress = RebalanceProgress(len(plan.moves))
+    for batch_start in range(0, len(commands), batch_size):
+        if batch_start > 0 and stop_event.wait(pause):
+            break
+        batch_moves = plan.moves[batch_start:batch_start + batch_size]
+        try:
+            results = client.run_archive_configuration_commands(
+                commands[batch_start:batch_start + batch_size])
+        except Exception as e:
+            progress.failed_moves.extend(
+                (move, str(e)) for move in batch_moves)
+        else:
+            for move, result in zip(batch_moves, results):
+                if not result.get('success'):
+                    progress.failed_moves.append(
+                        (move, result.get('errorMessage')))
+        progress.finished_moves += len(batch_moves)
+        if progress_callback is not None:
+            progress_callback(progress)
+    return progress
+
+
+def plan_rebalance(client,
+                   server_ids=None,
+                   weight=None,
+                   tolerance=0.05,
+                   drain_server_ids=()):
+    """
+    Read the channels of all servers and compute a rebalancing plan.
+
+    :param client:
+        ``AdminClient`` that is used for reading the cluster status and the
+        channels of each server.
+    :param server_ids:
+        IDs of the servers across which the load shall be distributed. If
+        ``None`` (the default), all servers that are online (according to the
+        cluster status) except the ones in ``drain_server_ids`` are used.
+    :param weight:
+        function that takes the information about a channel (as returned by
+        ``list_channels_for_server``) and returns its weight. If ``None`` (the
+        default), each channel has a weight of one.
+    :param tolerance:
+        fraction by which the load of a server may exceed the target load
+        before channels are moved away from it. The default is 0.05.
+    :param drain_server_ids:
+        IDs of servers from which all channels shall be moved to the other
+        servers.
+    :return:
+        ``RebalancePlan`` with the moves.
+    """
+    drain_server_ids = list(drain_server_ids)
+    if server_ids is None:
+        server_ids = [
+            server['serverId']
+            for server in client.get_cluster_status().get('servers', [])
+            if server.get('online')
+            and server['serverId'] not in drain_server_ids
+        ]
+    server_ids = list(server_ids)
+    table = list_channels_for_all_servers(
+        client, server_ids + drain_server_ids)
+    if not table.is_complete():
+        raise Exception(
+            'Could not list the channels of server(s) {0}.'.format(
+                ', '.join(sorted(table.server_errors))))
+    channels_by_server = {
+        server_id: {}
+        for server_id in server_ids + drain_server_ids
+    }
+    for channel in table.iter_rows():
+        channels_by_server[channel['serverId']][channel['channelName']] = (
+            1 if weight is None else weight(channel))
+    return compute_rebalance(
+        channels_by_server, server_ids, tolerance, drain_server_ids)
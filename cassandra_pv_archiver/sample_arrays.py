@@ -0,0 +1,301 @@
+"""
+Column-oriented representation of samples.
+
+Instead of a list with a dict for each sample, ``SampleArrays`` stores the
+time stamps and values of all samples in compact arrays (using the ``array``
+module), which need much less memory and can be converted to NumPy arrays
+without copying. ``WaveformArrays`` does the same for channels with
+array-valued samples (waveforms).
+"""
+
+import array
+import math
+
+from cassandra_pv_archiver import _samples
+
+# Type codes of the arrays storing the time stamps, the values, and the
+# offsets of the waveforms.
+OFFSET_TYPE_CODE = 'q'
+TIME_TYPE_CODE = 'q'
+VALUE_TYPE_CODE = 'd'
+
+
+class SampleArrays(object):
+    """
+    Samples of a channel stored in arrays.
+
+    The ``time`` array contains the time stamp of each sample (in nanoseconds
+    since epoch). The ``value`` array contains the value of each sample as a
+    floating-point number. Samples that do not have a value that is a single
+    number (e.g. because the channel was disconnected) have a value of NaN.
+
+    For decimated samples, the ``minimum`` and ``maximum`` arrays contain the
+    minimum and maximum of each sample. For raw samples, they are ``None``.
+    """
+
+    # Names of the arrays, in the order in which they are passed to the
+    # constructor.
+    _COLUMN_NAMES = ('time', 'value', 'minimum', 'maximum')
+
+    def __init__(self, time, value, minimum=None, maximum=None):
+        """
+        Create sample arrays.
+
+        :param time: array (type code ``q``) with the time stamps.
+        :param value: array (type code ``d``) with the values.
+        :param minimum: array (type code ``d``) with the minimums or ``None``.
+        :param maximum: array (type code ``d``) with the maximums or ``None``.
+        """
+        self.time = time
+        self.value = value
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __len__(self):
+        return len(self.time)
+
+    def is_decimated(self):
+        """
+        Tell whether the samples are decimated samples.
+
+        :return: ``True`` if the ``minimum`` and ``maximum`` arrays are
+            present, ``False`` otherwise.
+        """
+        return self.minimum is not None
+
+    def to_numpy(self):
+        """
+        Convert the arrays to NumPy arrays.
+
+        The NumPy arrays share the memory with the arrays of this object, so
+        no data is copied. This method needs the ``numpy`` package.
+
+        :return: dict mapping the names of the arrays (``time``, ``value``,
+            and, for decimated samples, ``minimum`` and ``maximum``) to NumPy
+            arrays.
+        """
+        import numpy
+        arrays = {
+            'time': numpy.frombuffer(self.time, dtype=numpy.int64),
+            'value': numpy.frombuffer(self.value, dtype=numpy.float64),
+        }
+        if self.minimum is not None:
+            arrays['minimum'] = numpy.frombuffer(
+                self.minimum, dtype=numpy.float64)
+            arrays['maximum'] = numpy.frombuffer(
+                self.maximum, dtype=numpy.float64)
+        return arrays
+
+
+class WaveformArrays(object):
+    """
+    Samples of a waveform channel stored in arrays.
+
+    The ``time`` array contains the time stamp of each sample (in nanoseconds
+    since epoch). The elements of all waveforms are stored one after another
+    in the ``values`` array, and the elements of the waveform of the i-th
+    sample are ``values[offsets[i]:offsets[i + 1]]``, so ``offsets`` has one
+    more element than there are samples. Samples without a value (e.g.
+    because the channel was disconnected) have an empty waveform. Elements
+    that are not numbers are stored as NaN.
+
+    If the samples are decimated and the server provides the minimum and
+    maximum of each element, they are stored in the ``minimum`` and
+    ``maximum`` arrays, which have the same layout as ``values``. Otherwise,
+    they are ``None``.
+
+    If all waveforms have the same length, ``element_count`` is that length,
+    and the values can be treated as a two-dimensional array (samples times
+    elements). Otherwise, it is ``None``.
+    """
+
+    # Names of the arrays, in the order in which they are passed to the
+    # constructor.
+    _COLUMN_NAMES = ('time', 'offsets', 'values', 'minimum', 'maximum')
+
+    def __init__(self, time, offsets, values, minimum=None, maximum=None):
+        """
+        Create waveform arrays.
+
+        :param time: array (type code ``q``) with the time stamps.
+        :param offsets: array (type code ``q``) with the offsets of the
+            waveforms.
+        :param values: array (type code ``d``) with the elements of all
+            waveforms.
+        :param minimum: array (type code ``d``) with the minimums or ``None``.
+        :param maximum: array (type code ``d``) with the maximums or ``None``.
+        """
+        self.time = time
+        self.offsets = offsets
+        self.values = values
+        self.minimum = minimum
+        self.maximum = maximum
+        self.element_count = None
+        if len(time) > 0:
+            element_count = offsets[1] - offsets[0]
+            if len(values) == element_count * len(time) and all(
+                    offsets[i] == i * element_count
+                    for i in range(len(offsets))):
+                self.element_count = element_count
+
+    def __len__(self):
+        return len(self.time)
+
+    def is_decimated(self):
+        """
+        Tell whether the minimum and maximum of each element are available.
+
+        :return: ``True`` if the ``minimum`` and ``maximum`` arrays are
+            present, ``False`` otherwise.
+        """
+        return self.minimum is not None
+
+    def is_uniform(self):
+        """
+        Tell whether all waveforms have the same length.
+
+        :return: ``True`` if ``element_count`` is not ``None``, ``False``
+            otherwise.
+        """
+        return self.element_count is not None
+
+    def row(self, index):
+        """
+        Return the waveform of a sample.
+
+        :param index: index of the sample.
+        :return: array with the elements of the waveform.
+        """
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def to_numpy(self):
+        """
+        Convert the arrays to NumPy arrays.
+
+        If all waveforms have the same length, the ``values`` (and
+        ``minimum`` and ``maximum``) arrays are returned as two-dimensional
+        arrays (samples times elements) and there is no ``offsets`` array.
+        Otherwise, they are returned as one-dimensional arrays together with
+        the ``offsets`` array. In both cases, the NumPy arrays share the
+        memory with the arrays of this object. This method needs the
+        ``numpy`` package.
+
+        :return: dict mapping the names of the arrays to NumPy arrays.
+        """
+        import numpy
+        arrays = {'time': numpy.frombuffer(self.time, dtype=numpy.int64)}
+        names = ['values']
+        if self.minimum is not None:
+            names.extend(('minimum', 'maximum'))
+        for name in names:
+            array_ = numpy.frombuffer(
+                getattr(self, name), dtype=numpy.float64)
+            if self.element_count is not None:
+                array_ = array_.reshape(len(self.time), self.element_count)
+            arrays[name] = array_
+        if self.element_count is None:
+            arrays['offsets'] = numpy.frombuffer(
+                self.offsets, dtype=numpy.int64)
+        return arrays
+
+
+def from_samples(samples):
+    """
+    Convert samples (as returned by the server) to arrays.
+
+    :param samples: iterable of samples. It is only iterated once, so it can
+        be an iterator that decodes the samples while they are received.
+    :return: ``SampleArrays`` with the samples.
+    """
+    time = array.array(TIME_TYPE_CODE)
+    value = array.array(VALUE_TYPE_CODE)
+    minimum = None
+    maximum = None
+    for sample in samples:
+        time.append(sample['time'])
+        value.append(_get_number_or_nan(sample, 'value'))
+        if 'minimum' in sample:
+            if minimum is None:
+                # The first samples might have been samples without a value,
+                # which do not have a minimum and maximum either.
+                minimum = array.array(VALUE_TYPE_CODE, value[:-1])
+                maximum = array.array(VALUE_TYPE_CODE, value[:-1])
+            minimum.append(_get_number_or_nan(sample, 'minimum'))
+            maximum.append(_get_number_or_nan(sample, 'maximum'))
+        elif minimum is not None:
+            minimum.append(value[-1])
+            maximum.append(value[-1])
+    return SampleArrays(time, value, minimum, maximum)
+
+
+def waveforms_from_samples(samples):
+    """
+    Convert samples of a waveform channel (as returned by the server) to
+    arrays.
+
+    The JSON decoder creates a list with the elements of each waveform. The
+    elements are copied from this list to the arrays sample by sample, so if
+    the samples are decoded while they are received, only the lists of one
+    sample are held in memory at a time.
+
+    :param samples: iterable of samples. It is only iterated once, so it can
+        be an iterator that decodes the samples while they are received.
+    :return: ``WaveformArrays`` with the samples.
+    """
+    time = array.array(TIME_TYPE_CODE)
+    offsets = array.array(OFFSET_TYPE_CODE, [0])
+    values = array.array(VALUE_TYPE_CODE)
+    minimum = None
+    maximum = None
+    for sample in samples:
+        time.append(sample['time'])
+        start = len(values)
+        _extend_numbers(values, sample.get('value'))
+        length = len(values) - start
+        if isinstance(sample.get('minimum'), list):
+            if minimum is None:
+                # The minimum and maximum of the previous samples (which did
+                # not have them) are the values themselves.
+                minimum = values[:start]
+                maximum = values[:start]
+            _extend_numbers(minimum, sample['minimum'], length)
+            _extend_numbers(maximum, sample.get('maximum'), length)
+        elif minimum is not None:
+            minimum.extend(values[start:])
+            maximum.extend(values[start:])
+        offsets.append(len(values))
+    return WaveformArrays(time, offsets, values, minimum, maximum)
+
+
+def _extend_numbers(target, numbers, length=None):
+    """
+    Append a list of numbers to an array.
+
+    Elements that are not numbers are appended as NaN. If ``numbers`` is not a
+    list, nothing is appended. If a length is specified, the list is truncated
+    or padded with NaN to that length.
+    """
+    if not isinstance(numbers, list):
+        numbers = []
+    if length is not None and len(numbers) != length:
+        numbers = (numbers + [math.nan] * length)[:length]
+    start = len(target)
+    try:
+        # This is the fast path, where the array converts the whole list.
+        target.extend(numbers)
+    except TypeError:
+        # The list contains elements that are not numbers, and the array might
+        # already contain some of the elements.
+        del target[start:]
+        target.extend(
+            number if isinstance(number, (int, float)) else math.nan
+            for number in numbers)
+
+
+def _get_number_or_nan(sample, key):
+    """
+    Return the single number stored under a key of a sample or NaN if the key
+    is missing or the value is not a single number.
+    """
+    value = _samples.get_number(sample, key)
+    return math.nan if value is None else value
@@ -0,0 +1,272 @@
+"""
+One-pass statistics over the samples of a channel.
+
+The statistics are accumulated sample by sample, so the samples can be
+consumed while they are being received and never have to be held in memory
+completely. The accumulators are updated by a plain Python loop, not by
+vectorized operations over arrays: the samples arrive one at a time from the
+JSON decoder and NumPy is not a dependency of this package, so there are no
+arrays that could be processed in bulk. Percentiles are estimated with a quantile sketch that guarantees
+a bounded relative error while only needing memory proportional to the
+logarithm of the range of values.
+"""
+
+import math
+
+from cassandra_pv_archiver import _samples
+
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class SampleSummary(object):
+    """
+    Statistics of the samples of a channel in a time range.
+
+    Samples without a value (e.g. because the channel was disconnected) and
+    samples with a value that is not a single number (e.g. strings or
+    waveforms) are not included in the statistics. They are counted in
+    ``skipped_count``. A sample before the start of the range only provides
+    the value at the start of the range, so it is only included in the
+    time-weighted statistics.
+
+    The statistics have the following attributes:
+
+    ``count``
+        number of samples included in the statistics.
+    ``minimum``, ``maximum``
+        smallest and largest value. For decimated samples, the minimum and
+        maximum of each sample are used.
+    ``mean``, ``std``
+        arithmetic mean and (population) standard deviation of the values.
+        Each sample has the same weight, regardless of how long its value was
+        valid.
+    ``percentiles``
+        dict mapping each requested percentile (between 0 and 100) to the
+        estimated value. Like the mean, the percentiles are not weighted by
+        time.
+    ``time_weighted_mean``
+        mean of the values, where each value is weighted by the time for which
+        it was valid (until the next sample or the end of the range).
+    ``integral``
+        integral of the values over time (in value times seconds), treating
+        the signal as constant between samples.
+    ``covered_duration``
+        time (in seconds) within the range for which a value was available.
+
+    ``time_weighted_mean`` and ``integral`` are ``None`` if no value was
+    available within the range. All other statistics except ``count`` are
+    ``None`` if no sample in the range has been included.
+    """
+
+    def __init__(self, channel_name, start_time, end_time):
+        """
+        Create empty statistics.
+
+        :param channel_name: name of the channel.
+        :param start_time: start of the time range (in nanoseconds since
+            epoch).
+        :param end_time: end of the time range (in nanoseconds since epoch).
+        """
+        self.channel_name = channel_name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.count = 0
+        self.skipped_count = 0
+        self.minimum = None
+        self.maximum = None
+        self.mean = None
+        self.std = None
+        self.percentiles = {}
+        self.time_weighted_mean = None
+        self.integral = None
+        self.covered_duration = 0.0
+
+    def __repr__(self):
+        return (
+            'SampleSummary(channel_name={0!r}, count={1}, minimum={2}, '
+            'maximum={3}, mean={4}, time_weighted_mean={5})'.format(
+                self.channel_name, self.count, self.minimum, self.maximum,
+                self.mean, self.time_weighted_mean))
+
+
+def summarize_samples(samples,
+                      start_time,
+                      end_time,
+                      channel_name=None,
+                      percentiles=DEFAULT_PERCENTILES,
+                      relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """
+    Calculate the statistics of a sequence of samples in one pass.
+
+    The samples must be ordered by time, like they are returned by the server.
+    As with the server's responses, the sequence may contain one sample before
+    the start time (its value is used from the start time on) and samples after
+    the end time (which are ignored).
+
+    :param samples:
+        iterable of samples (as returned by the server). It is only iterated
+        once, so it can be an iterator that decodes the samples while they are
+        received.
+    :param start_time:
+        start of the time range (in nanoseconds since epoch).
+    :param end_time:
+        end of the time range (in nanoseconds since epoch).
+    :param channel_name:
+        name of the channel that is stored in the returned statistics.
+    :param percentiles:
+        percentiles (between 0 and 100) that shall be estimated. The default
+        is the 50th, 90th, and 99th percentile.
+    :param relative_accuracy:
+        maximum relative error of the estimated percentiles. The default is
+        0.01 (one percent).
+    :return:
+        ``SampleSummary`` with the statistics.
+    """
+    summary = SampleSummary(channel_name, start_time, end_time)
+    sketch = _QuantileSketch(relative_accuracy)
+    count = 0
+    mean = 0.0
+    sum_squares = 0.0
+    minimum = math.inf
+    maximum = -math.inf
+    weighted_sum = 0.0
+    covered_time = 0
+    held_time = None
+    held_value = None
+    for sample in samples:
+        sample_time = sample['time']
+        # The previous value is valid until this sample (or the end of the
+        # range).
+        if held_value is not None:
+            duration = min(sample_time, end_time) - max(held_time, start_time)
+            if duration > 0:
+                weighted_sum += held_value * duration
+                covered_time += duration
+        held_value = None
+        if sample_time > end_time:
+            break
+        value = _get_finite_number(sample, 'value')
+        if sample_time < start_time:
+            # A sample before the start of the range only provides the value
+            # at the start of the range.
+            held_time = sample_time
+            held_value = value
+            continue
+        if value is None:
+            summary.skipped_count += 1
+            continue
+        held_time = sample_time
+        held_value = value
+        # We use Welford's algorithm, which is numerically stable even if the
+        # variance is small compared to the mean.
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        sum_squares += delta * (value - mean)
+        sample_minimum = _get_finite_number(sample, 'minimum')
+        if sample_minimum is None:
+            sample_minimum = value
+        sample_maximum = _get_finite_number(sample, 'maximum')
+        if sample_maximum is None:
+            sample_maximum = value
+        if sample_minimum < minimum:
+            minimum = sample_minimum
+        if sample_maximum > maximum:
+            maximum = sample_maximum
+        sketch.add(value)
+    if held_value is not None:
+        duration = end_time - max(held_time, start_time)
+        if duration > 0:
+            weighted_sum += held_value * duration
+            covered_time += duration
+    summary.count = count
+    summary.covered_duration = covered_time / 1e9
+    if covered_time > 0:
+        summary.integral = weighted_sum / 1e9
+        summary.time_weighted_mean = weighted_sum / covered_time
+    if count == 0:
+        return summary
+    summary.minimum = minimum
+    summary.maximum = maximum
+    summary.mean = mean
+    summary.std = math.sqrt(sum_squares / count)
+    summary.percentiles = {
+        percentile: min(maximum, max(minimum, sketch.quantile(
+            percentile / 100.0)))
+        for percentile in percentiles
+    }
+    return summary
+
+
+class _QuantileSketch(object):
+    """
+    Sketch for estimating quantiles with a bounded relative error.
+
+    The values are counted in buckets with logarithmically growing widths, so
+    that the relative error of the value representing a bucket is bounded (see
+    Masson et al., "DDSketch: A fast and fully-mergeable quantile sketch with
+    relative-error guarantees").
+    """
+
+    # Values with a smaller magnitude are counted as zero.
+    _MIN_MAGNITUDE = 1e-300
+
+    def __init__(self, relative_accuracy):
+        self._gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._count = 0
+        self._negative_buckets = {}
+        self._positive_buckets = {}
+        self._zero_count = 0
+
+    def add(self, value):
+        self._count += 1
+        if value > self._MIN_MAGNITUDE:
+            buckets = self._positive_buckets
+        elif value < -self._MIN_MAGNITUDE:
+            buckets = self._negative_buckets
+            value = -value
+        else:
+            self._zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def quantile(self, quantile):
+        if self._count == 0:
+            return None
+        rank = quantile * (self._count - 1)
+        seen = 0
+        for index in sorted(self._negative_buckets, reverse=True):
+            seen += self._negative_buckets[index]
+            if seen > rank:
+                return -self._bucket_value(index)
+        seen += self._zero_count
+        if seen > rank:
+            return 0.0
+        index = None
+        for index in sorted(self._positive_buckets):
+            seen += self._positive_buckets[index]
+            if seen > rank:
+                break
+        return self._bucket_value(index)
+
+    def _bucket_value(self, index):
+        return 2.0 * self._gamma ** index / (self._gamma + 1.0)
+
+
+def _get_finite_number(sample, key):
+    """
+    Return the single number stored under a key of a sample (as a ``float``)
+    or ``None`` if the key is missing or the value is not a single, finite
+    number.
+    """
+    value = _samples.get_number(sample, key)
+    if value is None:
+        return None
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    return value
@@ -0,0 +1,206 @@
+"""
+Coarse-to-fine scanning for threshold crossings.
+
+Finding all intervals in which a channel exceeded a limit does not require the
+raw samples for the whole time range. Decimated samples provide the minimum
+and maximum of each decimation period, so periods whose maximum does not
+exceed the limit cannot contain an event and periods whose minimum exceeds it
+are entirely part of an event. Only the remaining periods (where the limit is
+crossed) are examined more closely, first with finer decimated samples and
+finally with raw samples, which give the exact start and end of each event.
+
+The requests are sent by ``ArchiveClient.scan_threshold``. This module only
+contains the functions that evaluate the samples.
+"""
+
+from cassandra_pv_archiver import _samples
+
+# Maximum number of times a range is refined with decimated samples before
+# its raw samples are requested.
+_MAX_REFINEMENTS = 8
+
+# A refinement only counts as progress if the decimated samples are at least
+# this much closer together than in the previous step.
+_MIN_REFINEMENT_FACTOR = 0.9
+
+
+class ThresholdEvent(object):
+    """
+    Interval in which the value of a channel exceeded a threshold.
+
+    The interval starts with the first sample that exceeded the threshold (or
+    the start of the scanned range) and ends with the first sample that did not
+    exceed it anymore (or the end of the scanned range). Both times are
+    specified in nanoseconds since epoch.
+    """
+
+    __slots__ = ('channel_name', 'start_time', 'end_time')
+
+    def __init__(self, channel_name, start_time, end_time):
+        """
+        Create an event.
+
+        :param channel_name: name of the channel.
+        :param start_time: start of the interval.
+        :param end_time: end of the interval.
+        """
+        self.channel_name = channel_name
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def __eq__(self, other):
+        if not isinstance(other, ThresholdEvent):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__)
+
+    def __repr__(self):
+        return 'ThresholdEvent({0})'.format(', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+def classify_decimated_samples(samples, start_time, end_time, threshold,
+                                above=True, step=0, parent_width=None):
+    """
+    Classify the decimation periods of a range.
+
+    Periods in which the threshold was exceeded throughout are returned as
+    intervals that are part of an event. Periods in which the threshold might
+    have been crossed are returned as ranges that have to be examined more
+    closely. If the server returned raw samples instead of decimated ones,
+    the intervals are found directly and there are no such ranges.
+
+    :param samples:
+        list of samples ordered by time (as returned by the server).
+    :param start_time:
+        start of the range (in nanoseconds since epoch).
+    :param end_time:
+        end of the range (in nanoseconds since epoch).
+    :param threshold:
+        threshold that has to be exceeded.
+    :param above:
+        look for values above the threshold? If ``False``, values below the
+        threshold are looked for instead. Default is ``True``.
+    :param step:
+        number of times the range has been refined already.
+    :param parent_width:
+        width of the decimation periods (in nanoseconds) in the previous step
+        or ``None`` if this is the first step.
+    :return:
+        tuple of the list of intervals (as tuples of start and end time) that
+        are known to be part of an event and the list of ranges (as tuples of
+        start time, end time, step, and width of the decimation periods) that
+        need to be examined more closely. The step is ``None`` if the raw
+        samples have to be requested for the range.
+    """
+    if not any('maximum' in sample for sample in samples):
+        # The server returned raw samples (there is no decimation level that
+        # is coarse enough), so we have the exact answer already.
+        return find_threshold_intervals(
+            samples, start_time, end_time, threshold, above), []
+    samples = [
+        sample for sample in samples if sample['time'] <= end_time]
+    width = None
+    if len(samples) > 1:
+        width = (samples[-1]['time'] - samples[0]['time']) / (len(samples) - 1)
+    # If the decimated samples are not closer together than in the previous
+    # step, there is no finer decimation level, so the next step has to use
+    # the raw samples.
+    refine = (
+        step < _MAX_REFINEMENTS and width is not None
+        and (parent_width is None
+             or width < _MIN_REFINEMENT_FACTOR * parent_width))
+    intervals = []
+    candidates = []
+    for index, sample in enumerate(samples):
+        bucket_start = max(sample['time'], start_time)
+        bucket_end = (
+            samples[index + 1]['time'] if index + 1 < len(samples)
+            else end_time)
+        if bucket_end <= bucket_start:
+            continue
+        value = _samples.get_number(sample, 'value')
+        minimum = _samples.get_number(sample, 'minimum')
+        maximum = _samples.get_number(sample, 'maximum')
+        if minimum is None or maximum is None:
+            minimum = maximum = value
+        if value is None and minimum is None:
+            # The channel was disconnected for the whole period.
+            continue
+        if above:
+            fully_inside = minimum > threshold
+            maybe_inside = maximum > threshold
+        else:
+            fully_inside = maximum < threshold
+            maybe_inside = minimum < threshold
+        if fully_inside:
+            intervals.append((bucket_start, bucket_end))
+        elif maybe_inside:
+            candidates.append((bucket_start, bucket_end))
+    ranges = [
+        (candidate_start, candidate_end, step + 1 if refine else None, width)
+        for candidate_start, candidate_end in merge_intervals(candidates)
+    ]
+    return intervals, ranges
+
+
+def find_threshold_intervals(samples, start_time, end_time, threshold,
+                             above=True):
+    """
+    Find the intervals in which raw samples exceed a threshold.
+
+    :param samples:
+        iterable of samples ordered by time (as returned by the server). It is
+        only iterated once.
+    :param start_time:
+        start of the range (in nanoseconds since epoch). A sample before the
+        start is used for the value at the start.
+    :param end_time:
+        end of the range (in nanoseconds since epoch). Samples after the end
+        are only used for finding the end of an interval.
+    :param threshold:
+        threshold that has to be exceeded.
+    :param above:
+        look for values above the threshold? If ``False``, values below the
+        threshold are looked for instead. Default is ``True``.
+    :return:
+        list of tuples with the start and end time of each interval.
+    """
+    intervals = []
+    interval_start = None
+    for sample in samples:
+        sample_time = sample['time']
+        if sample_time > end_time:
+            break
+        value = _samples.get_number(sample, 'value')
+        hit = value is not None and (
+            value > threshold if above else value < threshold)
+        if hit and interval_start is None:
+            interval_start = max(sample_time, start_time)
+        elif not hit and interval_start is not None:
+            if sample_time > interval_start:
+                intervals.append((interval_start, sample_time))
+            interval_start = None
+    if interval_start is not None and end_time > interval_start:
+        intervals.append((interval_start, end_time))
+    return intervals
+
+
+def merge_intervals(intervals):
+    """
+    Sort intervals and merge the ones that overlap or touch.
+
+    :param intervals: iterable of tuples with the start and end time of each
+        interval.
+    :return: list of the merged intervals, ordered by time.
+    """
+    merged = []
+    for interval_start, interval_end in sorted(intervals):
+        if merged and interval_start <= merged[-1][1]:
+            if interval_end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], interval_end)
+        else:
+            merged.append((interval_start, interval_end))
+    return merged
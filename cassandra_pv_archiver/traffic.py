@@ -0,0 +1,535 @@
+"""
+Recording and replaying the traffic of the web-service clients.
+
+A ``TrafficRecorder`` is attached to one or more clients (``ArchiveClient``
+or ``AdminClient``) and writes every request that they send, together with
+its timing and the (compressed) response, to a file in JSON Lines format. A
+``TrafficReplayer`` serves these recordings from a local HTTP server and
+sends the recorded requests again at a chosen speed-up factor and
+concurrency, measuring the throughput and latency on the client side. This
+way, the load of a production system can be reproduced without access to
+the production servers.
+
+Recordings can be replayed from the command line::
+
+    python -m cassandra_pv_archiver.traffic recording.jsonl \\
+        --speed-up 10 --concurrency 32
+"""
+
+import argparse
+import base64
+import collections
+import concurrent.futures
+import gzip
+import http.server
+import io
+import json
+import sys
+import threading
+import time
+import urllib.request
+
+from cassandra_pv_archiver import _deadline
+
+# Request headers that are not recorded. The authorization header contains
+# credentials, and the others are set by urllib when the request is sent.
+_UNRECORDED_REQUEST_HEADERS = frozenset(
+    ['authorization', 'content-length', 'host', 'transfer-encoding'])
+
+# Response headers that are recorded and sent again when replaying.
+_REPLAYED_RESPONSE_HEADERS = ('Content-Type', 'Content-Encoding')
+
+
+class TrafficRecorder(object):
+    """
+    Recorder for the requests sent by web-service clients.
+
+    The recorder replaces the ``_do_req`` method of each attached client, so
+    that it sees every request that the client sends. Each response is read
+    completely before it is passed on to the client, so while the recorder is
+    attached, responses are not decoded while they are being received.
+
+    The ``Authorization`` header is never recorded. Request bodies are only
+    recorded if they are passed as a whole (streamed bodies, like those of
+    large configuration imports, are recorded as empty).
+
+    The recorder can be used as a context manager, which closes it (and
+    detaches it from all clients) when the block is left.
+    """
+
+    def __init__(self, path):
+        """
+        Create a recorder that appends to the specified file.
+
+        :param path: path to the file to which the requests are written.
+        """
+        self._clients = []
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def attach(self, client):
+        """
+        Start recording the requests of a client.
+
+        A client can only be attached to one recorder at a time, and only once.
+
+        :param client: ``ArchiveClient`` or ``AdminClient``.
+        """
+        if '_do_req' in vars(client):
+            # The method has already been replaced (by this or another
+            # recorder), and detaching would remove both wrappers.
+            raise Exception('A recorder is already attached to the client.')
+        do_req = client._do_req
+
+        def recording_do_req(req, *args, **kwargs):
+            return self._record(do_req, req, args, kwargs)
+        client._do_req = recording_do_req
+        self._clients.append(client)
+
+    def close(self):
+        """
+        Detach the recorder from all clients and close the file.
+        """
+        for client in list(self._clients):
+            self.detach(client)
+        with self._lock:
+            self._file.close()
+
+    def detach(self, client):
+        """
+        Stop recording the requests of a client.
+
+        :param client: client that has been passed to ``attach`` earlier.
+        """
+        self._clients.remove(client)
+        del client._do_req
+
+    def _record(self, do_req, req, args, kwargs):
+        """
+        Send a request through the original ``_do_req`` method and record it.
+        """
+        start_time = time.monotonic()
+        record = collections.OrderedDict()
+        record['start'] = start_time - self._start_time
+        record['method'] = req.get_method()
+        record['url'] = req.full_url
+        record['path'] = req.selector
+        record['requestHeaders'] = {
+            name: value for name, value in req.header_items()
+            if name.lower() not in _UNRECORDED_REQUEST_HEADERS
+        }
+        data = req.data
+        record['requestBody'] = (
+            base64.b64encode(gzip.compress(data)).decode()
+            if isinstance(data, bytes) else None)
+        try:
+            resp = do_req(req, *args, **kwargs)
+            try:
+                body = resp.read()
+            finally:
+                resp.close()
+        except Exception as e:
+            record['duration'] = time.monotonic() - start_time
+            record['error'] = repr(e)
+            self._write(record)
+            raise
+        record['duration'] = time.monotonic() - start_time
+        record['status'] = resp.code
+        response_headers = {
+            name: resp.headers.get(name)
+            for name in _REPLAYED_RESPONSE_HEADERS
+            if resp.headers.get(name) is not None
+        }
+        record['responseHeaders'] = response_headers
+        # The body is always stored compressed. If it was not compressed by
+        # the server, the replayer decompresses it before sending it.
+        if response_headers.get('Content-Encoding') == 'gzip':
+            stored_body = body
+        else:
+            stored_body = gzip.compress(body)
+        record['responseBody'] = base64.b64encode(stored_body).decode()
+        self._write(record)
+        return _RecordedResponse(resp.code, resp.headers, body)
+
+    def _write(self, record):
+        """
+        Append a record to the file.
+        """
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+                self._file.flush()
+
+
+class ReplayReport(object):
+    """
+    Client-side measurements of a replay.
+
+    ``request_count`` is the number of requests that have been sent and
+    ``error_count`` the number of requests that failed or got a different
+    status code than during the recording. ``elapsed_time`` is the duration
+    of the whole replay and ``throughput`` the number of requests per second.
+    ``latencies`` is a dict mapping the 50th, 90th, 99th, and 100th percentile
+    to the respective latency (in seconds, including receiving and decoding
+    the response).
+    """
+
+    def __init__(self, request_count, error_count, elapsed_time, latencies):
+        self.request_count = request_count
+        self.error_count = error_count
+        self.elapsed_time = elapsed_time
+        self.throughput = (
+            request_count / elapsed_time if elapsed_time > 0 else 0.0)
+        self.latencies = latencies
+
+    def report(self):
+        """
+        Return a human-readable report of the measurements.
+
+        :return:
+            multi-line string describing the measurements.
+        """
+        lines = [
+            'Replayed {0} request(s) in {1:.3f} s ({2:.1f} requests/s), '
+            '{3} error(s).'.format(
+                self.request_count, self.elapsed_time, self.throughput,
+                self.error_count)]
+        if self.latencies:
+            lines.append('  Latency: ' + ', '.join(
+                'p{0}: {1:.1f} ms'.format(percentile, latency * 1000.0)
+                for percentile, latency in sorted(self.latencies.items())))
+        return '\n'.join(lines)
+
+
+class TrafficReplayer(object):
+    """
+    Replayer for recorded traffic.
+
+    The replayer starts a local HTTP server that answers each request with a
+    recorded response for the same method and path (using the recorded
+    responses in turn if there are several). It then sends the recorded
+    requests to this server, preserving their relative timing (scaled by the
+    speed-up factor).
+
+    The replayer can be used as a context manager, which stops the server when
+    the block is left.
+    """
+
+    def __init__(self, path, server_latency=False):
+        """
+        Load the recording from a file.
+
+        Requests that failed during the recording (e.g. because of a timeout)
+        are not replayed.
+
+        :param path: path to the file that has been written by a
+            ``TrafficRecorder``.
+        :param server_latency: simulate the server's latency? If ``True``, the
+            local server waits for the recorded duration of each request
+            (divided by the speed-up factor) before sending the response.
+            Default is ``False``.
+        """
+        self._records = []
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if 'error' not in record:
+                    self._records.append(record)
+        self._records.sort(key=lambda record: record['start'])
+        self._responses = {}
+        for record in self._records:
+            self._responses.setdefault(
+                (record['method'], record['path']), []).append(record)
+        self._next_response = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._server_latency = server_latency
+        self._speed_up = 1.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop_server()
+
+    def __len__(self):
+        return len(self._records)
+
+    def run(self, speed_up=1.0, concurrency=8, timeout=60.0):
+        """
+        Replay the recorded requests against the local server.
+
+        The server is started if it is not running yet. Each request is sent
+        at its recorded time (relative to the first request) divided by the
+        speed-up factor. If all ``concurrency`` workers are busy, requests are
+        delayed until a worker is available.
+
+        :param speed_up: factor by which the replay is faster than the
+            recording. The default is one (original speed).
+        :param concurrency: maximum number of requests that are sent at the
+            same time. The default is eight.
+        :param timeout: maximum time (in seconds) for each request. Requests
+            that take longer are counted as errors. The default is 60 seconds.
+        :return: ``ReplayReport`` with the measurements.
+        """
+        if speed_up <= 0:
+            raise Exception('The speed-up factor must be positive.')
+        self._speed_up = speed_up
+        base_url = 'http://{0}:{1}'.format(*self.start_server())
+        latencies = []
+        error_count = 0
+        if not self._records:
+            return ReplayReport(0, 0, 0.0, {})
+        first_start = self._records[0]['start']
+        start_time = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=concurrency) as executor:
+            futures = []
+            for record in self._records:
+                delay = (
+                    start_time + (record['start'] - first_start) / speed_up
+                    - time.monotonic())
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(
+                    executor.submit(
+                        _replay_request, base_url, record, timeout))
+            for future in futures:
+                latency, success = future.result()
+                latencies.append(latency)
+                if not success:
+                    error_count += 1
+        elapsed_time = time.monotonic() - start_time
+        return ReplayReport(
+            len(latencies),
+            error_count,
+            elapsed_time,
+            _percentiles(latencies, (50, 90, 99, 100)))
+
+    def start_server(self, host='127.0.0.1', port=0):
+        """
+        Start the local HTTP server that serves the recorded responses.
+
+        Calling this method when the server is already running has no effect.
+
+        :param host: address on which the server listens. The default is the
+            loopback address.
+        :param port: port on which the server listens. The default is zero,
+            which selects a free port.
+        :return: tuple of the address and the port of the server.
+        """
+        if self._server is None:
+            self._server = http.server.ThreadingHTTPServer(
+                (host, port), _make_handler_class(self))
+            self._server.daemon_threads = True
+            threading.Thread(
+                target=self._server.serve_forever,
+                name='TrafficReplayServer',
+                daemon=True).start()
+        return self._server.server_address[:2]
+
+    def stop_server(self):
+        """
+        Stop the local HTTP server.
+
+        Calling this method when the server is not running has no effect.
+        """
+        server = self._server
+        self._server = None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def _get_response(self, method, path):
+        """
+        Return the next recorded response for a request or ``None`` if there is
+        no recording for the request.
+        """
+        records = self._responses.get((method, path))
+        if not records:
+            return None
+        with self._lock:
+            index = self._next_response[(method, path)]
+            self._next_response[(method, path)] = (index + 1) % len(records)
+        return records[index]
+
+
+def main(args=None):
+    """
+    Run the replay tool.
+
+    :param args:
+        command-line arguments (without the program name). If ``None`` (the
+        default), ``sys.argv`` is used.
+    :return:
+        exit code (zero if all requests were replayed successfully).
+    """
+    parser = argparse.ArgumentParser(
+        prog='cassandra-pv-archiver-replay',
+        description='Replay traffic recorded with a TrafficRecorder against a '
+                    'local server and report throughput and latencies.')
+    parser.add_argument(
+        'recording',
+        help='file written by the traffic recorder')
+    parser.add_argument(
+        '--speed-up', type=float, default=1.0,
+        help='factor by which the replay is faster than the recording '
+             '(default: 1)')
+    parser.add_argument(
+        '--concurrency', type=int, default=8,
+        help='maximum number of parallel requests (default: 8)')
+    parser.add_argument(
+        '--timeout', type=float, default=60.0,
+        help='maximum time for each request in seconds (default: 60)')
+    parser.add_argument(
+        '--server-latency', action='store_true',
+        help='let the local server wait for the recorded duration of each '
+             'request (divided by the speed-up factor)')
+    parsed_args = parser.parse_args(args)
+    if parsed_args.speed_up <= 0:
+        parser.error('The speed-up factor must be positive.')
+    if parsed_args.concurrency <= 0:
+        parser.error('The concurrency must be positive.')
+    if parsed_args.timeout <= 0:
+        parser.error('The timeout must be positive.')
+    with TrafficReplayer(
+            parsed_args.recording,
+            server_latency=parsed_args.server_latency) as replayer:
+        report = replayer.run(
+            speed_up=parsed_args.speed_up,
+            concurrency=parsed_args.concurrency,
+            timeout=parsed_args.timeout)
+    print(report.report())
+    return 0 if report.error_count == 0 else 1
+
+
+class _RecordedResponse(io.BytesIO):
+    """
+    Response that has been read completely by the recorder.
+    """
+
+    def __init__(self, code, headers, body):
+        super(_RecordedResponse, self).__init__(body)
+        self.code = code
+        self.headers = headers
+
+
+def _make_handler_class(replayer):
+    """
+    Create a request handler class for the replay server.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_DELETE(self):
+            self._replay()
+
+        def do_GET(self):
+            self._replay()
+
+        def do_POST(self):
+            self._replay()
+
+        def do_PUT(self):
+            self._replay()
+
+        # noinspection PyShadowingBuiltins
+        def log_message(self, format, *args):
+            pass
+
+        def _read_request_body(self):
+            if self.headers.get('Transfer-Encoding') == 'chunked':
+                while True:
+                    chunk_size = int(self.rfile.readline().split(b';')[0], 16)
+                    self.rfile.read(chunk_size + 2)
+                    if chunk_size == 0:
+                        return
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def _replay(self):
+            self._read_request_body()
+            record = replayer._get_response(self.command, self.path)
+            if record is None:
+                self.send_error(404, 'No recorded response')
+                return
+            if replayer._server_latency:
+                time.sleep(record['duration'] / replayer._speed_up)
+            body = base64.b64decode(record['responseBody'])
+            headers = record['responseHeaders']
+            if headers.get('Content-Encoding') != 'gzip':
+                body = gzip.decompress(body)
+            self.send_response(record['status'])
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def _percentiles(values, percentiles):
+    """
+    Return a dict mapping each of the percentiles to the respective value
+    (using the nearest-rank method).
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        percentile: values[max(
+            0, -(-percentile * len(values) // 100) - 1)]
+        for percentile in percentiles
+    }
+
+
+def _replay_request(base_url, record, timeout):
+    """
+    Send a recorded request and decode the response like a client would.
+
+    The timeout (in seconds) applies to the whole request, including reading
+    the response.
+
+    :return: tuple of the latency (in seconds) and a flag that tells whether
+        the request was successful.
+    """
+    body = record.get('requestBody')
+    if body is not None:
+        body = gzip.decompress(base64.b64decode(body))
+    req = urllib.request.Request(
+        base_url + record['path'],
+        data=body,
+        headers=record['requestHeaders'],
+        method=record['method'])
+    start_time = time.monotonic()
+    # noinspection PyBroadException
+    try:
+        resp = _deadline.urlopen(req, _deadline.from_timeout(timeout))
+        with resp:
+            data = resp.read()
+            if resp.headers.get('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            content_type = resp.headers.get('Content-Type', '')
+            if content_type.split(';')[0] == 'application/json':
+                json.loads(data.decode())
+        success = resp.code == record['status']
+    except Exception:
+        success = False
+    return time.monotonic() - start_time, success
+
+
+if __name__ == '__main__':
+    sys.exit(main())